@@ -1,5 +1,41 @@
 import dash
+from dash.dependencies import ClientsideFunction
+
+from metrics import init_metrics, instrument_callback
+from profiling import init_profiling, profile_callback
 
 
 app = dash.Dash(__name__)
 server = app.server
+init_metrics(server)
+init_profiling(server)
+
+CLIENTSIDE_NAMESPACE = 'gmprocess'
+
+
+def callback(*args, **kwargs):
+    # Every server-side callback is timed, with its latency, I/O and cache
+    # use exposed on /metrics and logged per request, and can be profiled
+    # on demand.
+    register = dash.Dash.callback(app, *args, **kwargs)
+
+    def decorator(func):
+        register(instrument_callback(profile_callback(func)))
+        return func
+    return decorator
+
+
+app.callback = callback
+
+
+def clientside_callback(outputs, inputs, states=[]):
+    # Registers a callback that runs in the browser. The JavaScript
+    # implementation lives in assets/clientside.js under the name of the
+    # decorated function, which is kept as the Python reference.
+    def decorator(func):
+        app.clientside_callback(
+            ClientsideFunction(namespace=CLIENTSIDE_NAMESPACE,
+                               function_name=func.__name__),
+            outputs, inputs, states)
+        return func
+    return decorator
@@ -0,0 +1,95 @@
+/* Clientside equivalents of the pure routing callbacks. Each function
+   mirrors the Python callback of the same name. */
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    gmprocess: {
+        handle_db_eq_click: function(db_eq_click, db_st_click, eq_map_click,
+                                     eq_moveout_click, eq_resid_click,
+                                     current_tab, current_event,
+                                     current_station, station_labels) {
+            var ctx = window.dash_clientside.callback_context;
+            var clickid = ctx.triggered.length ?
+                ctx.triggered[0].prop_id.split('.')[0] : '';
+
+            function getClickedStation(click_data) {
+                var point = click_data.points[0];
+                if ('hovertext' in point) {
+                    return point.hovertext;
+                }
+                return station_labels.stations[point.customdata];
+            }
+
+            if (db_eq_click && clickid === 'db_eq_map' &&
+                    db_eq_click.points[0].customdata[0]) {
+                return ['Event', db_eq_click.points[0].customdata[0],
+                        current_station];
+            } else if (db_st_click && clickid === 'db_sta_map' &&
+                    db_st_click.points[0].customdata[0]) {
+                return ['Station', current_event,
+                        db_st_click.points[0].customdata[0]];
+            } else if (eq_map_click && clickid === 'ev_eq_map') {
+                return ['Record', current_event,
+                        eq_map_click.points[0].customdata[0]];
+            } else if (eq_moveout_click && clickid === 'ev_moveout') {
+                return ['Record', current_event,
+                        getClickedStation(eq_moveout_click)];
+            } else if (eq_resid_click && clickid === 'ev_resid') {
+                return ['Record', current_event,
+                        getClickedStation(eq_resid_click)];
+            }
+            return [current_tab, current_event, current_station];
+        },
+
+        label_figures: function() {
+            var figures = Array.prototype.slice.call(arguments, 0, -1);
+            var labels = arguments[arguments.length - 1];
+            var arrayTypes = {i1: Int8Array, u1: Uint8Array, i2: Int16Array,
+                              u2: Uint16Array, i4: Int32Array,
+                              u4: Uint32Array};
+
+            function decodeArray(values) {
+                if (!values.bdata) {
+                    return values;
+                }
+                var bytes = atob(values.bdata);
+                var buffer = new Uint8Array(bytes.length);
+                for (var i = 0; i < bytes.length; i++) {
+                    buffer[i] = bytes.charCodeAt(i);
+                }
+                return new arrayTypes[values.dtype](buffer.buffer);
+            }
+
+            function labelFigure(fig) {
+                if (!fig || !fig.data || !labels) {
+                    return fig;
+                }
+                var data = fig.data.map(function(trace) {
+                    if (!(trace.meta in labels) || trace.customdata == null) {
+                        return trace;
+                    }
+                    var names = labels[trace.meta];
+                    var codes = decodeArray(trace.customdata);
+                    return Object.assign({}, trace, {
+                        text: Array.prototype.map.call(codes, function(code) {
+                            return names[code];
+                        })
+                    });
+                });
+                return Object.assign({}, fig, {data: data});
+            }
+
+            return figures.map(labelFigure);
+        },
+
+        update_rec_dropdowns: function(eqid, eq_options, stid, st_options) {
+            return [eqid, eq_options, stid, st_options];
+        },
+
+        init_session_id: function(storage_type, session_id) {
+            if (session_id) {
+                return session_id;
+            }
+            return Math.random().toString(16).slice(2) +
+                Date.now().toString(16);
+        }
+    }
+});
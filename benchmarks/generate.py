@@ -0,0 +1,280 @@
+import os
+import argparse
+
+import numpy as np
+import pandas as pd
+
+IMTS = ['PGA', 'PGV', 'SA(0.300)', 'SA(1.000)', 'SA(3.000)']
+FAILURE_REASONS = ['Failed SNR check', 'Failed clipping check',
+                   'Failed max amplitude check', 'Failed min. sampling rate',
+                   'Failed corner frequency check']
+CHANNELS = ['HNE', 'HNN', 'HNZ']
+SAMPLING_RATE = 100.0
+
+
+def generate_project(wdir, proj='synthetic', label='default', nevents=10,
+                     nstations=50, imcs=('rotd50.0',), fail_rate=0.2,
+                     workspaces=True, duration=120.0, seed=0):
+    # Writes a synthetic gmprocess project to wdir: the complete failures,
+    # events and metrics tables, the per-event failure reasons and,
+    # optionally, per-event workspaces. Every event is recorded by every
+    # station, so the number of records is nevents * nstations.
+    rng = np.random.default_rng(seed)
+    os.makedirs(wdir, exist_ok=True)
+
+    df_events = get_events(rng, nevents)
+    df_stations = get_stations(rng, nstations)
+    df_records = get_records(rng, df_events, df_stations, fail_rate)
+
+    df_records[['EarthquakeId', 'StationID', 'Failure reason']].to_csv(
+        os.path.join(wdir, '%s_%s_complete_failures.csv' % (proj, label)),
+        index=False)
+    df_events.to_csv(
+        os.path.join(wdir, '%s_%s_events.csv' % (proj, label)), index=False)
+
+    df_passed = df_records[df_records['Failure reason'].isnull()]
+    for imc in imcs:
+        get_metrics(rng, df_passed).to_csv(
+            os.path.join(wdir, '%s_%s_metrics_%s.csv' % (proj, label, imc)),
+            index=False)
+
+    for eqid, df_eq in df_records.groupby('EarthquakeId'):
+        os.makedirs(os.path.join(wdir, eqid), exist_ok=True)
+        df_eq[['StationID', 'Failure reason']].fillna('Passed').to_csv(
+            os.path.join(wdir, eqid, '%s_%s_failure_reasons_long.csv' % (
+                proj, label)), index=False)
+
+    if workspaces:
+        write_workspaces(rng, wdir, df_events, df_records, duration)
+    return df_records
+
+
+def get_events(rng, nevents):
+    times = pd.Timestamp('2000-01-01') + pd.to_timedelta(
+        np.sort(rng.uniform(0, 20 * 365, nevents)), unit='D')
+    return pd.DataFrame({
+        'id': ['se%08d' % idx for idx in range(nevents)],
+        'time': times.strftime('%Y-%m-%dT%H:%M:%S.%fZ'),
+        'latitude': rng.uniform(32, 42, nevents),
+        'longitude': rng.uniform(-124, -114, nevents),
+        'depth': rng.uniform(2, 20, nevents),
+        'magnitude': np.round(rng.uniform(3, 7.5, nevents), 1),
+        'magnitude_type': rng.choice(['ml', 'mw', 'mww'], nevents)})
+
+
+def get_stations(rng, nstations):
+    networks = rng.choice(['CI', 'NC', 'BK', 'NP', 'CE'], nstations)
+    return pd.DataFrame({
+        'Network': networks,
+        'StationCode': ['S%04d' % idx for idx in range(nstations)],
+        'StationID': ['%s.S%04d.HN' % (network, idx)
+                      for idx, network in enumerate(networks)],
+        'StationLatitude': rng.uniform(32, 42, nstations),
+        'StationLongitude': rng.uniform(-124, -114, nstations),
+        'StationElevation': rng.uniform(0, 2000, nstations)})
+
+
+def get_records(rng, df_events, df_stations, fail_rate):
+    df = df_events.merge(df_stations, how='cross')
+    failed = rng.random(df.shape[0]) < fail_rate
+    reasons = rng.choice(FAILURE_REASONS, df.shape[0])
+    df['EarthquakeId'] = df['id']
+    df['Failure reason'] = np.where(failed, reasons, None)
+    return df
+
+
+def get_metrics(rng, df):
+    nrecords = df.shape[0]
+    epi = get_distance(df['latitude'], df['longitude'],
+                       df['StationLatitude'], df['StationLongitude'])
+    hypo = np.sqrt(epi ** 2 + df['depth'] ** 2)
+    rup = np.maximum(hypo - 10 ** (0.5 * df['magnitude'] - 2.5), 1)
+    jb = np.sqrt(np.maximum(rup ** 2 - df['depth'] ** 2, 0))
+    metrics = pd.DataFrame({
+        'EarthquakeId': df['EarthquakeId'],
+        'EarthquakeTime': df['time'],
+        'EarthquakeLatitude': df['latitude'],
+        'EarthquakeLongitude': df['longitude'],
+        'EarthquakeDepth': df['depth'],
+        'EarthquakeMagnitude': df['magnitude'],
+        'EarthquakeMagnitudeType': df['magnitude_type'],
+        'Network': df['Network'],
+        'DataProvider': 'synthetic',
+        'StationCode': df['StationCode'],
+        'StationID': df['StationID'],
+        'StationDescription': '',
+        'StationLatitude': df['StationLatitude'],
+        'StationLongitude': df['StationLongitude'],
+        'StationElevation': df['StationElevation'],
+        'SamplingRate': SAMPLING_RATE,
+        'BackAzimuth': rng.uniform(0, 360, nrecords),
+        'EpicentralDistance': epi,
+        'HypocentralDistance': hypo,
+        'RuptureDistance': rup,
+        'RuptureDistanceVar': 0.0,
+        'JoynerBooreDistance': jb,
+        'JoynerBooreDistanceVar': 0.0})
+
+    # A simple magnitude and distance scaling with lognormal scatter
+    for idx, imt in enumerate(IMTS):
+        ln_amp = (1.2 * df['magnitude'] - 1.3 * np.log(rup + 10) - idx -
+                  rng.normal(0, 0.6, nrecords))
+        metrics[imt] = np.exp(ln_amp.values)
+    return metrics
+
+
+def get_distance(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = [np.radians(np.asarray(value, dtype=float))
+                              for value in [lat1, lon1, lat2, lon2]]
+    a = (np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) *
+         np.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * 6371 * np.arcsin(np.sqrt(a))
+
+
+def write_workspaces(rng, wdir, df_events, df_records, duration):
+    from gmprocess.io.asdf.stream_workspace import StreamWorkspace
+    from gmprocess.utils.event import ScalarEvent
+
+    for _, event in df_events.iterrows():
+        path = os.path.join(wdir, event['id'], 'workspace.h5')
+        if os.path.exists(path):
+            os.remove(path)
+        scalar_event = ScalarEvent()
+        scalar_event.fromParams(
+            event['id'], event['time'], event['latitude'],
+            event['longitude'], event['depth'], event['magnitude'],
+            event['magnitude_type'])
+        df_eq = df_records[df_records['EarthquakeId'] == event['id']]
+        raw, processed = get_streams(rng, df_eq, event['time'], duration)
+        workspace = StreamWorkspace(path)
+        workspace.addEvent(scalar_event)
+        workspace.addStreams(scalar_event, raw, label='unprocessed')
+        workspace.addStreams(scalar_event, processed, label='default')
+        workspace.close()
+
+
+def get_streams(rng, df_eq, time, duration):
+    from obspy import UTCDateTime
+    from gmprocess.core.stationtrace import StationTrace
+    from gmprocess.core.stationstream import StationStream
+    from gmprocess.core.streamcollection import StreamCollection
+
+    npts = int(duration * SAMPLING_RATE)
+    raw_streams = []
+    processed_streams = []
+    for _, record in df_eq.iterrows():
+        raw_traces = []
+        processed_traces = []
+        for channel in CHANNELS:
+            header = {
+                'network': record['Network'],
+                'station': record['StationCode'],
+                'channel': channel,
+                'location': '--',
+                'sampling_rate': SAMPLING_RATE,
+                'npts': npts,
+                'starttime': UTCDateTime(time),
+                'coordinates': {
+                    'latitude': record['StationLatitude'],
+                    'longitude': record['StationLongitude'],
+                    'elevation': record['StationElevation']},
+                'standard': get_standard_header(channel)}
+            data = get_trace_data(rng, npts)
+            raw_traces.append(StationTrace(data=data, header=header))
+            processed = StationTrace(data=data - data.mean(),
+                                     header=header.copy())
+            add_processing(rng, processed, record['Failure reason'])
+            processed_traces.append(processed)
+        raw_streams.append(StationStream(raw_traces))
+        processed_streams.append(StationStream(processed_traces))
+    return (StreamCollection(raw_streams),
+            StreamCollection(processed_streams))
+
+
+def get_standard_header(channel):
+    return {
+        'units': 'acc',
+        'units_type': 'acc',
+        'source': 'synthetic',
+        'source_format': 'synthetic',
+        'process_level': 'V1',
+        'instrument': '',
+        'instrument_period': np.nan,
+        'instrument_damping': np.nan,
+        'instrument_sensitivity': np.nan,
+        'sensor_serial_number': '',
+        'comments': '',
+        'station_name': '',
+        'horizontal_orientation': 0.0 if channel == 'HNN' else 90.0,
+        'vertical_orientation': np.nan,
+        'structure_type': '',
+        'corner_frequency': np.nan,
+        'process_time': '',
+        'source_file': ''}
+
+
+def get_trace_data(rng, npts):
+    # Windowed noise with a P and an S onset, so the traces have the
+    # amplitude envelope of a real record
+    t = np.arange(npts) / SAMPLING_RATE
+    onset = t[npts // 5]
+    envelope = 0.05 + np.where(
+        t > onset, np.exp(-(t - onset) / 15) * (t - onset) / 2, 0)
+    return rng.normal(0, 1, npts) * envelope
+
+
+def add_processing(rng, trace, failure_reason):
+    freq = np.logspace(-1.5, 1.5, 200)
+    sig_spec = 1 / (1 + (freq / 2) ** 2) * rng.uniform(0.8, 1.2, freq.size)
+    noi_spec = 0.01 * sig_spec * rng.uniform(0.5, 2, freq.size)
+    trace.setCached('signal_spectrum', {'spec': sig_spec, 'freq': freq})
+    trace.setCached('noise_spectrum', {'spec': noi_spec, 'freq': freq})
+    trace.setCached('smooth_signal_spectrum', {'spec': sig_spec,
+                                               'freq': freq})
+    trace.setCached('smooth_noise_spectrum', {'spec': noi_spec,
+                                              'freq': freq})
+    trace.setCached('snr', {'snr': sig_spec / noi_spec, 'freq': freq})
+    trace.setParameter('snr_conf', {'threshold': 3.0, 'min_freq': 0.2,
+                                    'max_freq': 5.0})
+    trace.setParameter('fit_spectra', {
+        'moment': 1e17, 'stress_drop': 10.0, 'epi_dist': 50.0,
+        'kappa': 0.04, 'f0': 1.0})
+    trace.setProvenance('lowpass_filter', {
+        'filter_type': 'Butterworth filter', 'corner_frequency': 20.0,
+        'number_of_passes': 2, 'filter_order': 5})
+    trace.setProvenance('highpass_filter', {
+        'filter_type': 'Butterworth filter', 'corner_frequency': 0.1,
+        'number_of_passes': 2, 'filter_order': 5})
+    if isinstance(failure_reason, str):
+        trace.fail(failure_reason)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Generate a synthetic gmprocess project.')
+    parser.add_argument('wdir', help='output working directory')
+    parser.add_argument('--proj', default='synthetic', help='project name')
+    parser.add_argument('--label', default='default',
+                        help='processing label')
+    parser.add_argument('-e', '--events', type=int, default=10,
+                        help='number of events')
+    parser.add_argument('-s', '--stations', type=int, default=50,
+                        help='number of stations')
+    parser.add_argument('--imcs', nargs='+', default=['rotd50.0'],
+                        help='intensity measure components')
+    parser.add_argument('--fail-rate', type=float, default=0.2,
+                        help='fraction of failed records')
+    parser.add_argument('--duration', type=float, default=120.0,
+                        help='record duration in seconds')
+    parser.add_argument('--no-workspaces', action='store_true',
+                        help='only write the CSV tables')
+    parser.add_argument('--seed', type=int, default=0, help='random seed')
+    args = parser.parse_args()
+
+    generate_project(args.wdir, args.proj, args.label, args.events,
+                     args.stations, args.imcs, args.fail_rate,
+                     not args.no_workspaces, args.duration, args.seed)
+
+
+if __name__ == '__main__':
+    main()
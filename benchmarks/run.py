@@ -0,0 +1,202 @@
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def measure(func, repeat):
+    # The first call runs with cold caches. The warm time is the best of the
+    # following calls, which go through the in-process caches.
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func()
+    cold = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    warm = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        warm.append(time.perf_counter() - start)
+    return result, {'cold': cold, 'warm': min(warm) if warm else None,
+                    'peak_memory': peak}
+
+
+def get_payload_size(result):
+    import plotly
+
+    try:
+        return len(json.dumps(result, cls=plotly.utils.PlotlyJSONEncoder))
+    except TypeError:
+        return None
+
+
+def get_benchmarks(wdir, proj, label, imc, imt, dist, mod):
+    from utils import (load_dfs, get_eq_imc_df, get_eq_full_status_df,
+                       evaluate_model)
+    from plots import (get_db_map_figure, get_db_net_bar_figure,
+                       get_db_fail_bar_figure, get_db_scatter_figure,
+                       get_eq_moveout_resid_figs, get_rec_plot)
+    from constants import DEFAULT_PARAMS, NPTS, AZIMUTH
+
+    df_status, df_imc, df_eq, df_st, df_net, df_events = load_dfs(
+        wdir, proj, label)
+    eqid = df_eq.sort_values('Number of total records')['id'].iloc[-1]
+    df_eq_imc = get_eq_imc_df(wdir, proj, label, eqid, imc)
+    stid = df_eq_imc['StationID'].iloc[0]
+    site_params = DEFAULT_PARAMS['site']
+    rup_params = DEFAULT_PARAMS['rup']
+
+    # Names follow the functions they time; each entry is a function of no
+    # arguments whose result is serialized to measure the payload size.
+    return [
+        ('load_dfs', lambda: load_dfs(wdir, proj, label)),
+        ('get_eq_imc_df',
+         lambda: get_eq_imc_df(wdir, proj, label, eqid, imc)),
+        ('get_eq_full_status_df',
+         lambda: get_eq_full_status_df(wdir, eqid, imc)),
+        ('get_rec_plot', lambda: get_rec_plot(eqid, stid, wdir)),
+        ('evaluate_model',
+         lambda: evaluate_model(site_params, rup_params, df_eq_imc, NPTS,
+                                AZIMUTH, mod, imt)),
+        ('get_db_map_figure[events]',
+         lambda: get_db_map_figure(
+             df_eq, 'latitude', 'longitude', 'id', 'magnitude',
+             'Earthquake Map', cluster=True)),
+        ('get_db_map_figure[stations]',
+         lambda: get_db_map_figure(
+             df_st, 'StationLatitude', 'StationLongitude', 'StationID',
+             'Number of total records', 'Station Map', cluster=True)),
+        ('get_db_net_bar_figure',
+         lambda: get_db_net_bar_figure(df_net, 'Number of total records')),
+        ('get_db_fail_bar_figure',
+         lambda: get_db_fail_bar_figure(df_status)),
+        ('get_db_scatter_figure[events]',
+         lambda: get_db_scatter_figure(
+             df_eq, 'time', 'magnitude', 'Number of passed records')),
+        ('get_db_scatter_figure[records]',
+         lambda: get_db_scatter_figure(
+             df_imc, 'EpicentralDistance', 'Cumulative exceedance', None)),
+        ('get_eq_moveout_resid_figs',
+         lambda: get_eq_moveout_resid_figs(
+             df_eq_imc, dist, imt, [mod], site_params, rup_params))]
+
+
+def run_benchmarks(wdir, proj, label, imc='rotd50.0', imt='PGA',
+                   dist='EpicentralDistance', mod='BooreEtAl2014',
+                   repeat=3):
+    results = {}
+    for name, func in get_benchmarks(wdir, proj, label, imc, imt, dist, mod):
+        try:
+            result, timings = measure(func, repeat)
+        except Exception as exception:
+            results[name] = {'error': repr(exception)}
+            continue
+        timings['payload_size'] = get_payload_size(result)
+        results[name] = timings
+    return results
+
+
+def compare_results(results, baseline, tolerance):
+    # Returns the benchmarks whose cold or warm time regressed by more than
+    # the tolerance relative to the baseline.
+    regressions = []
+    for name, timings in results.items():
+        reference = baseline.get(name, {})
+        for key in ['cold', 'warm']:
+            if timings.get(key) is None or reference.get(key) is None:
+                continue
+            if timings[key] > reference[key] * (1 + tolerance):
+                regressions.append((name, key, reference[key],
+                                    timings[key]))
+    return regressions
+
+
+def print_results(results):
+    print('%-32s %10s %10s %12s %12s' % (
+        'benchmark', 'cold (s)', 'warm (s)', 'peak (MB)', 'payload (kB)'))
+    for name, timings in results.items():
+        if 'error' in timings:
+            print('%-32s %s' % (name, timings['error']))
+            continue
+        print('%-32s %10.4f %10s %12.1f %12s' % (
+            name, timings['cold'],
+            '%.4f' % timings['warm'] if timings['warm'] is not None else '-',
+            timings['peak_memory'] / 1e6,
+            '%.1f' % (timings['payload_size'] / 1e3)
+            if timings['payload_size'] is not None else '-'))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Time the data loading and figure building functions '
+                    'of the dashboard against a synthetic project.')
+    parser.add_argument('-e', '--events', type=int, default=10,
+                        help='number of synthetic events')
+    parser.add_argument('-s', '--stations', type=int, default=50,
+                        help='number of synthetic stations')
+    parser.add_argument('--duration', type=float, default=120.0,
+                        help='synthetic record duration in seconds')
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+                        help='number of warm runs per benchmark')
+    parser.add_argument('--wdir', default=None,
+                        help='use an existing project instead of a '
+                             'synthetic one')
+    parser.add_argument('--proj', default='synthetic', help='project name')
+    parser.add_argument('--label', default='default',
+                        help='processing label')
+    parser.add_argument('--model', default='BooreEtAl2014',
+                        help='model used by the evaluation benchmarks')
+    parser.add_argument('-o', '--output', default=None,
+                        help='write the results to this JSON file')
+    parser.add_argument('-c', '--compare', default=None,
+                        help='baseline JSON file to compare against')
+    parser.add_argument('-t', '--tolerance', type=float, default=0.2,
+                        help='allowed relative slowdown when comparing')
+    args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp(prefix='gmprocess-visualize-benchmark-')
+    # Caches start empty so that the cold timings are meaningful. This has
+    # to happen before the dashboard modules are imported.
+    os.environ['GMPROCESS_VISUALIZE_CACHE'] = os.path.join(tmp_dir, 'cache')
+    sys.path.insert(0, ROOT)
+
+    wdir = args.wdir
+    if wdir is None:
+        from benchmarks.generate import generate_project
+
+        wdir = os.path.join(tmp_dir, 'project')
+        generate_project(wdir, args.proj, args.label, args.events,
+                         args.stations, duration=args.duration)
+
+    results = run_benchmarks(wdir, args.proj, args.label, mod=args.model,
+                             repeat=args.repeat)
+    print_results(results)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'python': platform.python_version(),
+                       'events': args.events,
+                       'stations': args.stations,
+                       'results': results}, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+        regressions = compare_results(results, baseline, args.tolerance)
+        for name, key, before, after in regressions:
+            print('Regression in %s (%s): %.4f s -> %.4f s' % (
+                name, key, before, after))
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,470 @@
+import io
+import os
+import re
+import json
+import hashlib
+import time
+import pickle
+import threading
+from functools import lru_cache, wraps
+from collections import OrderedDict
+
+import pandas as pd
+
+from constants import (CACHE_DIR, PARTITION_CACHE_SIZE, SHARED_CACHE_EXPIRE,
+                       SHARED_CACHE_BYTES, TAIL_BYTES)
+from metrics import count_bytes_read, count_cache
+
+# Columnar copies of the gmprocess CSVs are written as Parquet when pyarrow
+# is available and fall back to pickles otherwise.
+try:
+    import pyarrow  # NOQA
+    FRAME_FORMAT = 'parquet'
+except ImportError:
+    FRAME_FORMAT = 'pickle'
+
+PARTITION_LOCK = threading.Lock()
+MISSING = object()
+
+
+class LRUCache(object):
+    # A small thread-safe LRU mapping for values that cannot be memoized
+    # with functools.lru_cache because their keys are derived from the
+    # arguments rather than being the arguments themselves.
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                return default
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+
+def get_cache_files(cache_dir):
+    files = []
+    for root, _, names in os.walk(cache_dir):
+        for name in names:
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            files.append((path, stat.st_size, stat.st_mtime))
+    return files
+
+
+def prune_cache_files(cache_dir, max_bytes, expire=None):
+    # Expired files are removed, then the oldest ones down to 80% of the
+    # budget, so that pruning does not run on every write. Returns the size
+    # of the files that are left.
+    now = time.time()
+    files = sorted(get_cache_files(cache_dir), key=lambda file: file[2])
+    total = sum(size for _, size, _ in files)
+    for path, size, mtime in files:
+        if total <= 0.8 * max_bytes and (
+                expire is None or now - mtime <= expire):
+            break
+        try:
+            os.remove(path)
+            total -= size
+        except OSError:
+            pass
+    return total
+
+
+class FileSystemBackend(object):
+    # Shares pickled values between worker processes through files in a
+    # common directory. Entries older than expire seconds are ignored, and
+    # the directory is pruned when it outgrows max_bytes.
+
+    def __init__(self, cache_dir, expire=SHARED_CACHE_EXPIRE,
+                 max_bytes=SHARED_CACHE_BYTES):
+        self.cache_dir = cache_dir
+        self.expire = expire
+        self.max_bytes = max_bytes
+        self.nbytes = None
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def get(self, key):
+        path = os.path.join(self.cache_dir, key)
+        try:
+            if time.time() - os.path.getmtime(path) > self.expire:
+                return None
+            with open(path, 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def set(self, key, value):
+        path = os.path.join(self.cache_dir, key)
+        tmp_path = '%s.%d.tmp' % (path, os.getpid())
+        with open(tmp_path, 'wb') as f:
+            f.write(value)
+        os.replace(tmp_path, path)
+        # Overwritten entries are counted twice, which only makes the next
+        # prune come earlier
+        if self.nbytes is None:
+            self.nbytes = sum(size for _, size, _ in get_cache_files(
+                self.cache_dir))
+        else:
+            self.nbytes += len(value)
+        if self.nbytes > self.max_bytes:
+            self.nbytes = prune_cache_files(
+                self.cache_dir, self.max_bytes, self.expire)
+
+
+class RedisBackend(object):
+    # Shares pickled values through a Redis-compatible server. Entries
+    # expire so that the server does not need its own eviction policy.
+
+    def __init__(self, url, expire=SHARED_CACHE_EXPIRE):
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self.expire = expire
+
+    def get(self, key):
+        return self.client.get(key)
+
+    def set(self, key, value):
+        self.client.set(key, value, ex=self.expire)
+
+
+SHARED_CACHE = [FileSystemBackend(os.path.join(CACHE_DIR, 'shared'))]
+SHARED_CONFIG = [('filesystem', None)]
+
+
+def configure_shared_cache(backend='filesystem', url=None):
+    # The configuration is kept so that worker processes, which do not
+    # inherit it, can be configured the same way
+    SHARED_CONFIG[0] = (backend, url)
+    if backend == 'filesystem':
+        SHARED_CACHE[0] = FileSystemBackend(
+            url or os.path.join(CACHE_DIR, 'shared'))
+    elif backend == 'redis':
+        SHARED_CACHE[0] = RedisBackend(url or 'redis://localhost:6379/0')
+    elif backend == 'none':
+        SHARED_CACHE[0] = None
+    else:
+        raise ValueError('Cache backend %s is not supported' % backend)
+
+
+def get_shared_key(key):
+    return hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+
+
+def get_shared(key, default=None):
+    if SHARED_CACHE[0] is None:
+        return default
+    try:
+        value = SHARED_CACHE[0].get(get_shared_key(key))
+        if value is None:
+            return default
+        return pickle.loads(value)
+    except Exception:
+        return default
+
+
+def set_shared(key, value):
+    if SHARED_CACHE[0] is None:
+        return
+    try:
+        SHARED_CACHE[0].set(get_shared_key(key), pickle.dumps(
+            value, protocol=pickle.HIGHEST_PROTOCOL))
+    except Exception:
+        pass
+
+
+def memoize(maxsize):
+    # Like functools.lru_cache, but misses in the local LRU fall back to the
+    # shared cache so that every worker process reuses the same results. The
+    # arguments must have a stable repr.
+    def decorator(func):
+        local = LRUCache(maxsize)
+
+        @wraps(func)
+        def wrapper(*args):
+            key = (func.__module__, func.__name__) + args
+            value = local.get(key, MISSING)
+            if value is not MISSING:
+                count_cache(func.__name__, 'hit')
+                return value
+            value = get_shared(key, MISSING)
+            if value is MISSING:
+                count_cache(func.__name__, 'miss')
+                value = func(*args)
+                set_shared(key, value)
+            else:
+                count_cache(func.__name__, 'shared_hit')
+            local.set(key, value)
+            return value
+        return wrapper
+    return decorator
+
+
+def get_file_signature(path):
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def get_project_cache_dir(wdir):
+    digest = hashlib.sha1(
+        os.path.abspath(wdir).encode('utf-8')).hexdigest()[:16]
+    cache_dir = os.path.join(CACHE_DIR, digest)
+    os.makedirs(cache_dir, exist_ok=True)
+    return cache_dir
+
+
+def read_csv(path):
+    count_bytes_read('csv', os.path.getsize(path))
+    return pd.read_csv(path)
+
+
+def read_frame(path):
+    count_bytes_read('frame', os.path.getsize(path))
+    if FRAME_FORMAT == 'parquet':
+        return pd.read_parquet(path)
+    return pd.read_pickle(path)
+
+
+def write_frame(df, path):
+    # Write to a temporary file first so that concurrent readers never see
+    # a partially written frame.
+    tmp_path = '%s.%d.tmp' % (path, os.getpid())
+    try:
+        if FRAME_FORMAT == 'parquet':
+            df.to_parquet(tmp_path)
+        else:
+            df.to_pickle(tmp_path)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return False
+    return True
+
+
+def read_table(path, cache_dir):
+    name = get_table_name(path)
+    return get_cached_frame(cache_dir, name, get_file_signature(path),
+                            lambda: read_csv(path))
+
+
+def get_table_name(path):
+    return os.path.basename(path).rsplit('.csv', 1)[0]
+
+
+def get_cached_frame_path(cache_dir, name, signature):
+    return os.path.join(
+        cache_dir, '%s-%d-%d.%s' % ((name,) + tuple(signature) +
+                                    (FRAME_FORMAT,)))
+
+
+def get_file_tail_hash(path, size, nbytes=TAIL_BYTES):
+    # Fingerprint of the nbytes before offset size, used to check that a
+    # file that grew was only appended to
+    with open(path, 'rb') as f:
+        f.seek(max(size - nbytes, 0))
+        return hashlib.sha1(f.read(min(size, nbytes))).hexdigest()
+
+
+def is_appended(path, old_size, size, old_tail_hash):
+    return size > old_size and old_tail_hash is not None and (
+        get_file_tail_hash(path, old_size) == old_tail_hash)
+
+
+def append_table(path, cache_dir, old_signature, old_tail_hash):
+    # Builds the cached frame of a CSV that gmprocess appended rows to from
+    # the cached frame of its previous version and the new rows only.
+    # Returns False when the change was not a clean append, in which case
+    # the table is read in full the next time it is needed.
+    name = get_table_name(path)
+    old_path = get_cached_frame_path(cache_dir, name, old_signature)
+    signature = get_file_signature(path)
+    old_size, size = old_signature[1], signature[1]
+    if not os.path.exists(old_path) or not is_appended(
+            path, old_size, size, old_tail_hash):
+        return False
+    with open(path, 'rb') as f:
+        header = f.readline()
+        f.seek(old_size)
+        tail = f.read(size - old_size)
+    if not tail.endswith(b'\n'):
+        # The file is still being written
+        return False
+    count_bytes_read('csv', len(header) + len(tail))
+
+    df_old = read_frame(old_path)
+    delta = pd.read_csv(io.BytesIO(header + tail))
+    if list(delta.columns) != list(df_old.columns):
+        return False
+    for col in delta.columns:
+        try:
+            delta[col] = delta[col].astype(df_old[col].dtype)
+        except (TypeError, ValueError):
+            pass
+    df = pd.concat([df_old, delta], ignore_index=True)
+    cached_path = get_cached_frame_path(cache_dir, name, signature)
+    if write_frame(df, cached_path):
+        remove_stale_tables(cache_dir, name, cached_path)
+        return True
+    return False
+
+
+def get_cached_frame(cache_dir, name, signature, build):
+    # Frames derived from a single source file are stored under the
+    # signature of that file, and older versions are removed once the new
+    # one has been written.
+    cached_path = get_cached_frame_path(cache_dir, name, signature)
+    if os.path.exists(cached_path):
+        count_cache('frame', 'hit')
+        return read_frame(cached_path)
+
+    count_cache('frame', 'miss')
+    df = build()
+    if write_frame(df, cached_path):
+        remove_stale_tables(cache_dir, name, cached_path)
+    return df
+
+
+def remove_stale_tables(cache_dir, name, keep_path):
+    pattern = re.compile(
+        r'^%s-\d+-\d+\.%s$' % (re.escape(name), FRAME_FORMAT))
+    for file in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, file)
+        if pattern.match(file) and path != keep_path:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def read_json(path):
+    if os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    return {}
+
+
+def write_json(data, path):
+    tmp_path = '%s.%d.tmp' % (path, os.getpid())
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def get_optional_signature(path):
+    if os.path.exists(path):
+        return list(get_file_signature(path))
+
+
+def get_event_partition(wdir, proj, label, eqid, imc):
+    # Metrics are partitioned per event into a store that sits next to the
+    # columnar tables, with each partition pre-joined with the event's
+    # failure reasons. The manifest records the signatures each partition
+    # was built from so that only stale partitions are rewritten.
+    metrics_file = os.path.join(
+        wdir, '%s_%s_metrics_%s.csv' % (proj, label, imc))
+    failures_file = os.path.join(
+        wdir, eqid, '%s_%s_failure_reasons_long.csv' % (proj, label))
+    cache_dir = get_project_cache_dir(wdir)
+    store_dir = os.path.join(
+        cache_dir, '%s_%s_metrics_%s' % (proj, label, imc))
+    manifest_path = os.path.join(store_dir, 'manifest.json')
+
+    with PARTITION_LOCK:
+        os.makedirs(store_dir, exist_ok=True)
+        manifest = read_json(manifest_path)
+        signature = list(get_file_signature(metrics_file))
+        if manifest.get('metrics') != signature:
+            manifest = build_event_partitions(
+                wdir, proj, label, metrics_file, cache_dir, store_dir,
+                manifest)
+            manifest['metrics'] = signature
+            manifest['tail'] = get_file_tail_hash(metrics_file, signature[1])
+            write_json(manifest, manifest_path)
+
+        entry = manifest['events'].get(eqid)
+        if entry is None:
+            return None
+        if entry['failures'] != get_optional_signature(failures_file):
+            df = read_table(metrics_file, cache_dir)
+            entry = write_event_partition(
+                wdir, proj, label, eqid, df[df['EarthquakeId'] == eqid],
+                store_dir)
+            manifest['events'][eqid] = entry
+            write_json(manifest, manifest_path)
+
+    return read_event_partition(
+        os.path.join(store_dir, '%s.%s' % (eqid, FRAME_FORMAT)),
+        entry['hash'], tuple(entry['failures'] or ()))
+
+
+def build_event_partitions(wdir, proj, label, metrics_file, cache_dir,
+                           store_dir, manifest):
+    df = read_table(metrics_file, cache_dir)
+    events = manifest.get('events', {})
+    if 'rows' in manifest and is_appended(
+            metrics_file, manifest['metrics'][1],
+            get_file_signature(metrics_file)[1], manifest['tail']):
+        # When gmprocess only appended rows, only the events that appear
+        # in the new rows are rewritten and nothing else is hashed
+        changed = df['EarthquakeId'].iloc[manifest['rows']:].unique()
+        updated = dict(events)
+        for eqid, df_eq in df[df['EarthquakeId'].isin(changed)].groupby(
+                'EarthquakeId', sort=False):
+            updated[eqid] = write_event_partition(
+                wdir, proj, label, eqid, df_eq, store_dir)
+        return {'events': updated, 'rows': df.shape[0]}
+
+    updated = {}
+    for eqid, df_eq in df.groupby('EarthquakeId', sort=False):
+        entry = events.get(eqid)
+        if entry is not None and entry['hash'] == get_frame_hash(df_eq):
+            updated[eqid] = entry
+        else:
+            updated[eqid] = write_event_partition(
+                wdir, proj, label, eqid, df_eq, store_dir)
+    for eqid in set(events) - set(updated):
+        path = os.path.join(store_dir, '%s.%s' % (eqid, FRAME_FORMAT))
+        if os.path.exists(path):
+            os.remove(path)
+    return {'events': updated, 'rows': df.shape[0]}
+
+
+def write_event_partition(wdir, proj, label, eqid, df, store_dir):
+    failures_file = os.path.join(
+        wdir, eqid, '%s_%s_failure_reasons_long.csv' % (proj, label))
+    entry = {'hash': get_frame_hash(df),
+             'failures': get_optional_signature(failures_file)}
+    if entry['failures'] is not None:
+        df = df.merge(read_csv(failures_file),
+                      left_on='StationID', right_on='StationID')
+    write_frame(df.reset_index(drop=True),
+                os.path.join(store_dir, '%s.%s' % (eqid, FRAME_FORMAT)))
+    return entry
+
+
+def get_frame_hash(df):
+    return str(pd.util.hash_pandas_object(df, index=False).sum())
+
+
+def get_params_hash(*params):
+    return hashlib.sha1(json.dumps(
+        params, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+@lru_cache(maxsize=PARTITION_CACHE_SIZE)
+def read_event_partition(path, frame_hash, failures_signature):
+    return read_frame(path)
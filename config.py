@@ -0,0 +1,33 @@
+import os
+import json
+
+ENV_PREFIX = 'GMPROCESS_VISUALIZE_'
+DEFAULT_CONFIG = {
+    'wdir': None,
+    'proj': None,
+    'label': None,
+    'cache_backend': 'filesystem',
+    'cache_url': None,
+    'remote_event_lookup': False,
+    'watch': True}
+
+
+def load_config(path=None, **overrides):
+    # Settings are read from the defaults, then an optional JSON config file
+    # (GMPROCESS_VISUALIZE_CONFIG), then GMPROCESS_VISUALIZE_<KEY>
+    # environment variables and finally explicit keyword arguments.
+    config = dict(DEFAULT_CONFIG)
+    path = path or os.environ.get(ENV_PREFIX + 'CONFIG')
+    if path:
+        with open(path) as f:
+            config.update(json.load(f))
+    for key in DEFAULT_CONFIG:
+        if ENV_PREFIX + key.upper() in os.environ:
+            config[key] = os.environ[ENV_PREFIX + key.upper()]
+    config.update({key: value for key, value in overrides.items()
+                   if value is not None})
+
+    if any(config[key] is None for key in ['wdir', 'proj', 'label']):
+        raise ValueError(
+            'You must provide three arguments: wdir, project, and label')
+    return config
@@ -1,6 +1,5 @@
+import os
 import re
-import warnings
-from openquake.hazardlib.gsim import get_available_gsims
 
 
 DEFAULT_PARAMS = {
@@ -32,15 +31,6 @@ MAPBOX_ACCESS_TOKEN = ('pk.eyJ1IjoianJla29za2UiLCJhIjoiY2p5amJ3ZnJpMDIzbjNlbjd'
                        'jdXJ5bTQ5MSJ9.QjIZKHgkxz21YOKkxLBOVQ')
 IMT_REGEX = re.compile(r'PGA|PGV|SA\(*|FAS\(*|ARIAS|DURATION')
 DIST_REGEX = re.compile(r'.*Distance$')
-MODELS_DICT = {}
-for item in get_available_gsims().items():
-    with warnings.catch_warnings(record=True) as caught_warnings:
-        try:
-            item[1]()
-        except Exception:
-            continue
-    if not caught_warnings:
-        MODELS_DICT[item[0]] = item[1]
 ALL_PARAMS = [param for param_type in DEFAULT_PARAMS.keys()
               for param in DEFAULT_PARAMS[param_type]]
 AZIMUTH = 0
@@ -49,6 +39,60 @@ DIST_DICT = {'EpicentralDistance': ('repi', 'Epicentral distance (km)'),
              'RuptureDistance': ('rrup', 'Rupture distance (km)'),
              'JoynerBooreDistance': ('rjb', 'Joyner-Boore distance (km)')}
 NPTS = 100
-
-
-
+CACHE_DIR = os.environ.get(
+    'GMPROCESS_VISUALIZE_CACHE',
+    os.path.join(os.path.expanduser('~'), '.cache', 'gmprocess-visualize'))
+PROJECT_CACHE_SIZE = 4
+PARTITION_CACHE_SIZE = 16
+EVALUATION_CACHE_SIZE = 256
+EVALUATION_WORKERS = int(os.environ.get(
+    'GMPROCESS_VISUALIZE_EVALUATION_WORKERS', os.cpu_count() or 1))
+EVALUATION_TIMEOUT = 30
+EVALUATION_RETRY = 300
+REC_CACHE_SIZE = 16
+REC_PLOT_WIDTH = 1800
+MAX_OPEN_WORKSPACES = 8
+PREFETCH_STATIONS = 8
+DEFAULT_MAP_ZOOM = 5
+CLUSTER_MAX_ZOOM = 8
+CLUSTER_MIN_POINTS = 2000
+CLUSTER_CELLS = 16
+WEBGL_THRESHOLD = 10000
+# The plotly.js bundled with dash_core_components predates typed array
+# support (plotly.js 2.28), so base64 encoding is opt-in for deployments
+# with a newer dash
+ENCODE_TYPED_ARRAYS = os.environ.get(
+    'GMPROCESS_VISUALIZE_TYPED_ARRAYS', 'false').lower() in [
+        'true', '1', 'yes']
+SORTED_VIEW_CACHE_SIZE = 32
+DEFAULT_NBINS = 300
+SHARED_CACHE_EXPIRE = 24 * 3600
+SHARED_CACHE_BYTES = 2**30
+JOB_WORKERS = int(os.environ.get(
+    'GMPROCESS_VISUALIZE_JOB_WORKERS', os.cpu_count() or 1))
+JOB_EVALUATION_WORKERS = int(os.environ.get(
+    'GMPROCESS_VISUALIZE_JOB_EVALUATION_WORKERS', 4))
+JOB_DIR = os.path.join(CACHE_DIR, 'jobs')
+JOB_EXPIRE = 3600
+JOB_HEARTBEAT = 10
+JOB_STALE = 300
+JOB_STORE_BYTES = 512 * 2**20
+JOB_POLL_INTERVAL = 500
+PROFILE_MODE = os.environ.get('GMPROCESS_VISUALIZE_PROFILE', 'off')
+PROFILE_DIR = os.environ.get(
+    'GMPROCESS_VISUALIZE_PROFILE_DIR', os.path.join(CACHE_DIR, 'profiles'))
+PROFILE_HEADER = 'X-Profile'
+PROFILE_RETENTION = 100
+PROFILE_LISTING = 50
+TAIL_BYTES = 4096
+WATCH_INTERVAL = 5
+DATA_POLL_INTERVAL = 10000
+FIGURE_CACHE_DIR = os.path.join(CACHE_DIR, 'figures')
+FIGURE_CACHE_BYTES = 256 * 2**20
+FIGURE_DISK_BYTES = 2 * 2**30
+FIGURE_COMPRESS = True
+# Bumped when the structure of cached figures or job results changes
+FIGURE_CACHE_VERSION = 2
+VS30_COLUMNS = ['StationVs30', 'Vs30', 'vs30']
+MIXED_EFFECTS_ITERATIONS = 100
+MIXED_EFFECTS_TOLERANCE = 1e-6
@@ -0,0 +1,69 @@
+import os
+from functools import lru_cache
+
+from constants import PROJECT_CACHE_SIZE, PARTITION_CACHE_SIZE
+from cache import get_file_signature
+from utils import load_dfs, get_project_version
+from workspaces import open_workspace
+
+EVENT_COLUMNS = ['id', 'time', 'latitude', 'longitude', 'depth',
+                 'magnitude', 'magnitude_type']
+REMOTE_LOOKUP = [False]
+
+
+def configure_event_lookup(remote=False):
+    # Remote catalog lookups are off by default so that the dashboard works
+    # without network access.
+    REMOTE_LOOKUP[0] = str(remote).lower() in ['true', '1', 'yes']
+
+
+def get_event_index(wdir, proj, label):
+    return _get_event_index(
+        wdir, proj, label, get_project_version(wdir, proj, label))
+
+
+@lru_cache(maxsize=PROJECT_CACHE_SIZE)
+def _get_event_index(wdir, proj, label, version):
+    df_events = load_dfs(wdir, proj, label)[5]
+    columns = [col for col in EVENT_COLUMNS if col in df_events.columns]
+    return {event['id']: event for event in
+            df_events[columns].to_dict('records')}
+
+
+def get_event_info(wdir, proj, label, eqid):
+    # Events are looked up in the project's events table first, then in the
+    # event's workspace and only then, if enabled, in the remote catalog.
+    event = get_event_index(wdir, proj, label).get(eqid)
+    if event is not None:
+        return format_event(event)
+    path = os.path.join(wdir, eqid, 'workspace.h5')
+    if os.path.exists(path):
+        return get_workspace_event_info(eqid, path, get_file_signature(path))
+    if REMOTE_LOOKUP[0]:
+        return get_remote_event_info(eqid)
+    return eqid
+
+
+def format_event(event):
+    # Same format as the repr of gmprocess' ScalarEvent
+    return '%s %s %.3f %.3f %.1fkm M%.1f %s' % (
+        event['id'], event['time'], event['latitude'], event['longitude'],
+        event['depth'], event['magnitude'], event.get('magnitude_type', ''))
+
+
+@lru_cache(maxsize=PARTITION_CACHE_SIZE)
+def get_workspace_event_info(eqid, path, signature):
+    with open_workspace(path) as handle:
+        return repr(handle.workspace.getEvent(eqid))
+
+
+@lru_cache(maxsize=None)
+def get_remote_event_info(eqid):
+    # Failed lookups are cached too, so an unreachable catalog is only
+    # tried once per event.
+    from gmprocess.utils.event import get_event_object
+
+    try:
+        return repr(get_event_object(eqid))
+    except Exception:
+        return eqid
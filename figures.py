@@ -0,0 +1,137 @@
+import os
+import json
+import zlib
+import hashlib
+import threading
+from functools import wraps
+from collections import OrderedDict
+
+import plotly
+
+from constants import (FIGURE_CACHE_DIR, FIGURE_CACHE_BYTES,
+                       FIGURE_DISK_BYTES, FIGURE_COMPRESS,
+                       FIGURE_CACHE_VERSION)
+from cache import get_cache_files, prune_cache_files
+from metrics import count_cache
+
+
+class FigureCache(object):
+    # Serialized figures keyed by content hash. The memory tier is an LRU
+    # bounded by the total size of the stored bytes. Every entry is also
+    # written to a disk tier, which keeps entries evicted from memory, is
+    # shared by all processes and is pruned oldest first when it outgrows
+    # its own budget.
+
+    def __init__(self, max_bytes, cache_dir, max_disk_bytes):
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.max_disk_bytes = max_disk_bytes
+        self.disk_bytes = None
+        self._data = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                return self._data[key]
+        try:
+            with open(self.get_path(key), 'rb') as f:
+                data = f.read()
+        except OSError:
+            return None
+        self.set(key, data, write=False)
+        return data
+
+    def set(self, key, data, write=True):
+        with self._lock:
+            if key in self._data:
+                self._size -= len(self._data[key])
+            self._data[key] = data
+            self._size += len(data)
+            while self._size > self.max_bytes and len(self._data) > 1:
+                self._size -= len(self._data.popitem(last=False)[1])
+        if write:
+            self.write(key, data)
+
+    def get_path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def write(self, key, data):
+        path = self.get_path(key)
+        if os.path.exists(path):
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = '%s.%d.tmp' % (path, os.getpid())
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError:
+            return
+        if self.disk_bytes is None:
+            self.disk_bytes = sum(size for _, size, _ in get_cache_files(
+                self.cache_dir))
+        else:
+            self.disk_bytes += len(data)
+        if self.disk_bytes > self.max_disk_bytes:
+            self.disk_bytes = prune_cache_files(
+                self.cache_dir, self.max_disk_bytes)
+
+
+FIGURE_CACHE = FigureCache(FIGURE_CACHE_BYTES, FIGURE_CACHE_DIR,
+                           FIGURE_DISK_BYTES)
+
+
+def get_figure_key(name, key):
+    # The key must include the versions of the data the figure is built
+    # from, so that new data never hits a stale entry
+    return hashlib.sha1(
+        repr((FIGURE_CACHE_VERSION, name) + tuple(key)).encode(
+            'utf-8')).hexdigest()
+
+
+def dump_figure(fig):
+    data = json.dumps(fig, cls=plotly.utils.PlotlyJSONEncoder).encode(
+        'utf-8')
+    if FIGURE_COMPRESS:
+        return b'z' + zlib.compress(data, 1)
+    return b'j' + data
+
+
+def load_figure(data):
+    if data[:1] == b'z':
+        return json.loads(zlib.decompress(data[1:]).decode('utf-8'))
+    return json.loads(data[1:].decode('utf-8'))
+
+
+def get_cached_figure(name, key, build):
+    # Figures (or any JSON-serializable callback results) are stored
+    # serialized, so a hit skips pandas, h5py and plotly entirely. Results
+    # that are None are not cached.
+    digest = get_figure_key(name, key)
+    data = FIGURE_CACHE.get(digest)
+    if data is not None:
+        count_cache('figure', 'hit')
+        return load_figure(data)
+    count_cache('figure', 'miss')
+    fig = build()
+    if fig is None:
+        return None
+    # Misses return the decoded copy as well, so callers always get the
+    # same types (lists, and None for NaN) whether or not the entry existed
+    data = dump_figure(fig)
+    FIGURE_CACHE.set(digest, data)
+    return load_figure(data)
+
+
+def cache_figure(func):
+    # Decorator for figure builders whose arguments, including the data
+    # versions they are passed, fully determine the figure
+    @wraps(func)
+    def wrapper(*args):
+        return get_cached_figure(
+            '%s.%s' % (func.__module__, func.__name__), args,
+            lambda: func(*args))
+    return wrapper
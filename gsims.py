@@ -0,0 +1,93 @@
+import os
+import warnings
+import importlib
+from functools import lru_cache
+
+from openquake.baselib import __version__ as OQ_VERSION
+
+from constants import CACHE_DIR
+from cache import read_json, write_json
+
+
+def get_constant_name(value):
+    # Newer openquake versions define IMCs as enums rather than strings
+    return getattr(value, 'value', value)
+
+
+def get_capabilities_path():
+    return os.path.join(CACHE_DIR, 'gsims-%s.json' % OQ_VERSION)
+
+
+@lru_cache(maxsize=None)
+def get_capabilities():
+    # The capability table is expensive to build because every GSIM has to
+    # be imported and instantiated to check its validity, so it is
+    # persisted per openquake version and shared by all processes.
+    path = get_capabilities_path()
+    if os.path.exists(path):
+        return read_json(path)
+    capabilities = build_capabilities()
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    write_json(capabilities, path)
+    return capabilities
+
+
+def build_capabilities():
+    from openquake.hazardlib.gsim import get_available_gsims
+
+    capabilities = {}
+    for name, gsim in get_available_gsims().items():
+        with warnings.catch_warnings(record=True) as caught_warnings:
+            try:
+                gsim()
+                valid = True
+            except Exception:
+                valid = False
+        if not valid or caught_warnings:
+            capabilities[name] = {'valid': False}
+            continue
+        capabilities[name] = {
+            'valid': True,
+            'module': gsim.__module__,
+            'class': gsim.__name__,
+            'imts': sorted(imt.__name__ for imt in
+                           gsim.DEFINED_FOR_INTENSITY_MEASURE_TYPES),
+            'imc': get_constant_name(
+                gsim.DEFINED_FOR_INTENSITY_MEASURE_COMPONENT),
+            'sites': sorted(gsim.REQUIRES_SITES_PARAMETERS),
+            'rupture': sorted(gsim.REQUIRES_RUPTURE_PARAMETERS),
+            'distances': sorted(gsim.REQUIRES_DISTANCES)}
+    return capabilities
+
+
+@lru_cache(maxsize=None)
+def get_model_capabilities():
+    return {name: capability for name, capability in
+            get_capabilities().items() if capability['valid']}
+
+
+@lru_cache(maxsize=None)
+def get_model_index():
+    # Maps (IMT class name, IMC) to the sorted names of the valid models that
+    # are defined for that combination.
+    index = {}
+    for name, capability in sorted(get_model_capabilities().items()):
+        for imt in capability['imts']:
+            index.setdefault((imt, capability['imc']), []).append(name)
+    return index
+
+
+@lru_cache(maxsize=None)
+def get_required_params(name):
+    capability = get_model_capabilities()[name]
+    return frozenset(capability['sites'] + capability['rupture'])
+
+
+@lru_cache(maxsize=None)
+def get_gsim(name):
+    capability = get_model_capabilities()[name]
+    gsim = getattr(importlib.import_module(capability['module']),
+                   capability['class'])
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        return gsim()
@@ -1,38 +1,76 @@
 import os
 import sys
+import uuid
 import importlib
 
 import dash_ui as dui
 import dash_html_components as html
 import dash_core_components as dcc
+from dash.dependencies import Input, Output, State
+
+from app import app, clientside_callback
+from cache import configure_shared_cache
+from config import load_config
+from events import configure_event_lookup
+from watcher import configure_watcher, get_data_version
+from constants import TAB_STYLE, DATA_POLL_INTERVAL
+
+TABS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tabs')
+
+
+@clientside_callback(
+    Output('session_id', 'data'),
+    [Input('session_id', 'storage_type')],
+    [State('session_id', 'data')]
+)
+def init_session_id(storage_type, session_id):
+    # Identifies the browser tab so that its background jobs can be
+    # cancelled when they are superseded
+    return session_id or uuid.uuid4().hex
+
+
+def create_app(config_path=None, **overrides):
+    config = load_config(config_path, **overrides)
+    configure_shared_cache(config['cache_backend'], config['cache_url'])
+    configure_event_lookup(config['remote_event_lookup'])
+    configure_watcher(config['watch'])
+    wdir, proj, label = config['wdir'], config['proj'], config['label']
+    # Start watching the configured project right away
+    get_data_version(wdir, proj, label)
+
+    # Dynamically import all callbacks from tab directory
+    tab_ids = [tab_id for tab_id in sorted(os.listdir(TABS_DIR)) if
+               os.path.exists(os.path.join(TABS_DIR, tab_id, 'callbacks.py'))]
+    for tab_id in tab_ids:
+        importlib.import_module('tabs.%s.callbacks' % tab_id)
+
+    # Create app layout using tab layouts specified in tab directory
+    app.layout = html.Div([
+        dcc.Store(id='session_id', storage_type='session'),
+        dcc.Store(id='data_version'),
+        dcc.Interval(id='data_poll', interval=DATA_POLL_INTERVAL),
+        dcc.Tabs(id='tabs', value='Database', content_style=TAB_STYLE,
+                 children=[
+                     dcc.Tab(label=tab_id.capitalize(),
+                             value=tab_id.capitalize(), children=[
+                                 dui.Layout(
+                                     grid=importlib.import_module(
+                                         'tabs.%s.layout' % tab_id).get_grid(),
+                                     controlpanel=importlib.import_module(
+                                         'tabs.%s.layout' % tab_id
+                                     ).get_control_panel(wdir, proj, label))])
+                     for tab_id in tab_ids])])
+    return app
 
-from app import app
-from constants import TAB_STYLE
-
-# Load wdir, proj, and label arguments
-if len(sys.argv) == 4:
-    wdir, proj, label = sys.argv[1:]
-else:
-    raise ValueError(
-        'You must provide three arguments: wdir, project, and label')
-
-
-# Dynamically import all callbacks from tab directory
-tab_ids = os.listdir('tabs')
-for tab_id in tab_ids:
-    importlib.import_module('tabs.%s.callbacks' % tab_id)
-
-# Create app layout using tab layouts specified in tab directory
-app.layout = html.Div(
-    dcc.Tabs(id='tabs', value='Database', content_style=TAB_STYLE, children=[
-        dcc.Tab(label=tab_id.capitalize(), value=tab_id.capitalize(), children=[
-            dui.Layout(
-                grid=importlib.import_module(
-                    'tabs.%s.layout' % tab_id).get_grid(),
-                controlpanel=importlib.import_module(
-                    'tabs.%s.layout' % tab_id).get_control_panel(
-                        wdir, proj, label))])
-             for tab_id in tab_ids]))
 
 if __name__ == '__main__':
-    app.run_server(host='127.0.0.1', debug=True)
+    # Load wdir, proj, and label arguments
+    if len(sys.argv) == 4:
+        wdir, proj, label = sys.argv[1:]
+    elif len(sys.argv) == 1:
+        wdir = proj = label = None
+    else:
+        raise ValueError(
+            'You must provide three arguments: wdir, project, and label')
+    create_app(wdir=wdir, proj=proj, label=label).run_server(
+        host='127.0.0.1', debug=True)
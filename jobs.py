@@ -0,0 +1,217 @@
+import os
+import time
+import uuid
+import pickle
+import socket
+import hashlib
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from constants import (JOB_WORKERS, JOB_DIR, JOB_EXPIRE, JOB_STORE_BYTES,
+                       JOB_HEARTBEAT, JOB_STALE)
+from cache import (FileSystemBackend, SHARED_CONFIG,
+                   configure_shared_cache)
+from profiling import should_profile, get_trace_id, run_profiled
+from metrics import start_job_stats, finish_job_stats, record_job
+
+JOBS_LOCK = threading.Lock()
+FUTURES = {}
+POOL = [None]
+HOST = socket.gethostname()
+# Status, progress, results and cancellation flags of the jobs are files in
+# a directory that every process on the host shares, so any worker of a
+# multi-process server can answer the polls of a job that another one
+# submitted. Servers spread over several hosts need the cache directory
+# on a shared filesystem.
+JOB_STORE = FileSystemBackend(JOB_DIR, JOB_EXPIRE, JOB_STORE_BYTES)
+
+
+class JobCancelled(Exception):
+    pass
+
+
+def get_job_value(name):
+    value = JOB_STORE.get(name)
+    if value is not None:
+        return pickle.loads(value)
+
+
+def set_job_value(name, value):
+    JOB_STORE.set(name, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+def set_job_status(job_id, status, fraction=0, message='', result=None,
+                   stats=None):
+    # The host and pid are those of the process in charge of the job: the
+    # server while it is queued and the job worker once it runs
+    set_job_value('job-%s' % job_id, {
+        'status': status, 'progress': fraction, 'message': message,
+        'result': result, 'stats': stats, 'host': HOST, 'pid': os.getpid(),
+        'updated': time.time()})
+
+
+def is_stale(job_id, record):
+    # Running jobs whose process is gone (e.g. after a restart or a crash)
+    # never finish. On the same host this is checked with the pid, records
+    # from other hosts go stale when neither progress nor the worker's
+    # heartbeat updated them for JOB_STALE seconds.
+    if record['status'] != 'running':
+        return False
+    if record['host'] == HOST:
+        try:
+            os.kill(record['pid'], 0)
+        except ProcessLookupError:
+            return True
+        except OSError:
+            pass
+        return False
+    beat = get_job_value('beat-%s' % job_id) or 0
+    return time.time() - max(record['updated'], beat) > JOB_STALE
+
+
+def get_store_name(prefix, key):
+    return '%s-%s' % (prefix, hashlib.sha1(repr(key).encode(
+        'utf-8')).hexdigest())
+
+
+def get_mp_context():
+    # Forking a threaded server copies its locks in whatever state other
+    # threads left them, so workers are started from a clean process
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('forkserver')
+    return multiprocessing.get_context('spawn')
+
+
+def get_job_pool():
+    if POOL[0] is None:
+        POOL[0] = ProcessPoolExecutor(
+            max_workers=JOB_WORKERS, mp_context=get_mp_context(),
+            initializer=configure_shared_cache, initargs=SHARED_CONFIG[0])
+    return POOL[0]
+
+
+def run_job(job_id, func, args, trace_id='', profile=False):
+    def progress(fraction, message=''):
+        if get_job_value('cancel-%s' % job_id):
+            raise JobCancelled()
+        set_job_status(job_id, 'running', fraction, message)
+
+    def heartbeat():
+        while not stopped.wait(JOB_HEARTBEAT):
+            set_job_value('beat-%s' % job_id, time.time())
+
+    set_job_status(job_id, 'running')
+    stopped = threading.Event()
+    threading.Thread(target=heartbeat, daemon=True).start()
+    # Bytes read and cache lookups are totalled per job and stored with its
+    # status, together with the trace id of the request that submitted it
+    start_job_stats()
+    try:
+        # Jobs submitted by a profiled request are profiled in the worker
+        if profile:
+            result = run_profiled(func, args, {'progress': progress},
+                                  trace_id)
+        else:
+            result = func(*args, progress=progress)
+    except JobCancelled:
+        status, message, result = 'cancelled', '', None
+    except Exception as e:
+        status, message, result = 'failed', str(e), None
+    else:
+        status, message = 'done', ''
+    finally:
+        stopped.set()
+    stats = finish_job_stats()
+    stats.update(job=func.__name__, trace_id=trace_id)
+    set_job_status(job_id, status, 1, message, result, stats)
+
+
+def finish_job(job_id, future):
+    # Jobs that never ran, or whose worker died, cannot report themselves
+    FUTURES.pop(job_id, None)
+    if future.cancelled():
+        set_job_status(job_id, 'cancelled')
+    elif future.exception() is not None:
+        set_job_status(job_id, 'failed', 1, str(future.exception()))
+
+
+def start_job(job_id, func, args):
+    job_args = (job_id, func, args, get_trace_id(), should_profile())
+    set_job_status(job_id, 'running')
+    try:
+        future = get_job_pool().submit(run_job, *job_args)
+    except BrokenProcessPool:
+        POOL[0] = None
+        future = get_job_pool().submit(run_job, *job_args)
+    FUTURES[job_id] = future
+    future.add_done_callback(lambda future: finish_job(job_id, future))
+
+
+def is_reusable(job_id):
+    record = get_job_value('job-%s' % job_id)
+    if record is None or record['status'] in ['failed', 'cancelled'] or (
+            is_stale(job_id, record)):
+        return False
+    return record['status'] == 'done' or not get_job_value(
+        'cancel-%s' % job_id)
+
+
+def submit_job(key, slot, func, *args):
+    # Identical jobs (same key) are deduplicated, including finished ones
+    # that have not expired from the store. A slot identifies who is
+    # waiting for the job (e.g. the record plot of one browser session);
+    # submitting a new job to a slot cancels the previous one unless another
+    # slot is still waiting for it.
+    key_name = get_store_name('key', key)
+    slot_name = get_store_name('slot', slot)
+    with JOBS_LOCK:
+        job_id = get_job_value(key_name)
+        if job_id is None or not is_reusable(job_id):
+            job_id = uuid.uuid4().hex
+            set_job_value(key_name, job_id)
+            start_job(job_id, func, args)
+
+        previous = get_job_value(slot_name)
+        if previous is not None and previous != job_id:
+            slots = get_job_value('slots-%s' % previous) or set()
+            slots.discard(slot_name)
+            set_job_value('slots-%s' % previous, slots)
+            if not slots:
+                cancel_job(previous)
+        slots = get_job_value('slots-%s' % job_id) or set()
+        slots.add(slot_name)
+        set_job_value('slots-%s' % job_id, slots)
+        set_job_value(slot_name, job_id)
+    return job_id
+
+
+def cancel_job(job_id):
+    record = get_job_value('job-%s' % job_id)
+    if record is None or record['status'] != 'running':
+        return
+    # Jobs queued in this process are dropped from the pool, all others
+    # stop at their next progress report
+    future = FUTURES.get(job_id)
+    if future is None or not future.cancel():
+        set_job_value('cancel-%s' % job_id, True)
+
+
+def get_job_status(job_id):
+    # Returns a (status, progress, message, result) tuple, where status is
+    # one of 'unknown', 'running', 'done', 'failed' or 'cancelled'.
+    record = get_job_value('job-%s' % job_id)
+    if record is None:
+        return 'unknown', 0, '', None
+    if is_stale(job_id, record):
+        return 'failed', 1, 'The job was lost', None
+    stats = record['stats']
+    if stats is not None and not stats.get('reported'):
+        # The first poll that sees a finished job reports its totals
+        stats['reported'] = True
+        set_job_value('job-%s' % job_id, record)
+        record_job(stats['job'], job_id, stats['trace_id'],
+                   record['status'], stats)
+    return (record['status'], record['progress'], record['message'],
+            record['result'])
@@ -0,0 +1,228 @@
+import json
+import time
+import uuid
+import logging
+import threading
+from bisect import bisect_left
+from functools import wraps
+from collections import defaultdict
+
+import flask
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0, 30.0)
+SIZE_BUCKETS = (1e3, 1e4, 1e5, 1e6, 1e7, 1e8)
+TRACE_HEADER = 'X-Trace-Id'
+
+METRICS_LOCK = threading.Lock()
+COUNTERS = defaultdict(float)
+HISTOGRAMS = {}
+HELP = {
+    'gmprocess_visualize_callback_seconds':
+        ('histogram', 'Callback latency in seconds'),
+    'gmprocess_visualize_callback_calls_total':
+        ('counter', 'Callback calls by outcome'),
+    'gmprocess_visualize_response_bytes':
+        ('histogram', 'Serialized callback response size in bytes'),
+    'gmprocess_visualize_bytes_read_total':
+        ('counter', 'Bytes read from project files by source'),
+    'gmprocess_visualize_cache_requests_total':
+        ('counter', 'Cache lookups by cache and result'),
+    'gmprocess_visualize_job_seconds':
+        ('histogram', 'Background job run time in seconds'),
+    'gmprocess_visualize_job_calls_total':
+        ('counter', 'Background jobs by outcome')}
+
+LOGGER = logging.getLogger('gmprocess_visualize')
+JOB_STATS = threading.local()
+
+
+def inc_counter(name, labels=(), value=1):
+    with METRICS_LOCK:
+        COUNTERS[(name, labels)] += value
+
+
+def observe(name, labels, value, buckets):
+    with METRICS_LOCK:
+        histogram = HISTOGRAMS.get((name, labels))
+        if histogram is None:
+            histogram = HISTOGRAMS[(name, labels)] = [
+                [0] * (len(buckets) + 1), 0.0, buckets]
+        # Counts are stored per bucket and accumulated when rendered
+        histogram[0][bisect_left(buckets, value)] += 1
+        histogram[1] += value
+
+
+def get_request_stats():
+    # Per-request totals that end up in the structured log line of the
+    # request, or per-job totals inside a background job worker. Other work
+    # done outside of a request or job is only counted in the process-wide
+    # metrics.
+    if flask.has_request_context():
+        return getattr(flask.g, 'request_stats', None)
+    return getattr(JOB_STATS, 'stats', None)
+
+
+def new_stats():
+    return {'bytes_read': defaultdict(int), 'cache': defaultdict(int)}
+
+
+def start_job_stats():
+    JOB_STATS.stats = new_stats()
+    JOB_STATS.start = time.perf_counter()
+
+
+def finish_job_stats():
+    # Plain dicts, so that the totals can be stored with the job status
+    stats = JOB_STATS.stats
+    JOB_STATS.stats = None
+    return {'duration': time.perf_counter() - JOB_STATS.start,
+            'bytes_read': dict(stats['bytes_read']),
+            'cache': dict(stats['cache'])}
+
+
+def record_job(job, job_id, trace_id, status, stats):
+    # Job workers are separate processes whose metrics are never scraped,
+    # so the process that reports the finished job exports its totals and
+    # logs them under the trace id of the request that submitted it
+    labels = (('job', job),)
+    observe('gmprocess_visualize_job_seconds', labels, stats['duration'],
+            LATENCY_BUCKETS)
+    inc_counter('gmprocess_visualize_job_calls_total',
+                labels + (('status', status),))
+    for source, nbytes in stats['bytes_read'].items():
+        inc_counter('gmprocess_visualize_bytes_read_total',
+                    (('source', source),), nbytes)
+    for name, count in stats['cache'].items():
+        cache, result = name.rsplit(':', 1)
+        inc_counter('gmprocess_visualize_cache_requests_total',
+                    (('cache', cache), ('result', result)), count)
+    LOGGER.info(json.dumps({
+        'trace_id': trace_id,
+        'job': job,
+        'job_id': job_id,
+        'status': status,
+        'duration': round(stats['duration'], 6),
+        'bytes_read': stats['bytes_read'],
+        'cache': stats['cache']}))
+
+
+def count_bytes_read(source, nbytes):
+    inc_counter('gmprocess_visualize_bytes_read_total',
+                (('source', source),), nbytes)
+    stats = get_request_stats()
+    if stats is not None:
+        stats['bytes_read'][source] += nbytes
+
+
+def count_cache(cache, result):
+    inc_counter('gmprocess_visualize_cache_requests_total',
+                (('cache', cache), ('result', result)))
+    stats = get_request_stats()
+    if stats is not None:
+        stats['cache']['%s:%s' % (cache, result)] += 1
+
+
+def instrument_callback(func):
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        status = 'error'
+        try:
+            result = func(*args, **kwargs)
+            status = 'ok'
+            return result
+        finally:
+            duration = time.perf_counter() - start
+            labels = (('callback', func.__name__),)
+            observe('gmprocess_visualize_callback_seconds', labels,
+                    duration, LATENCY_BUCKETS)
+            inc_counter('gmprocess_visualize_callback_calls_total',
+                        labels + (('status', status),))
+            stats = get_request_stats()
+            if stats is not None:
+                stats.update(callback=func.__name__, status=status,
+                             duration=duration)
+    return wrapper
+
+
+def start_request():
+    flask.g.trace_id = flask.request.headers.get(
+        TRACE_HEADER) or uuid.uuid4().hex
+    flask.g.request_stats = new_stats()
+
+
+def finish_request(response):
+    stats = get_request_stats()
+    response.headers[TRACE_HEADER] = getattr(flask.g, 'trace_id', '')
+    if stats is None or 'callback' not in stats:
+        return response
+    size = response.calculate_content_length()
+    if size is None:
+        size = len(response.get_data())
+    observe('gmprocess_visualize_response_bytes',
+            (('callback', stats['callback']),), size, SIZE_BUCKETS)
+    LOGGER.info(json.dumps({
+        'trace_id': flask.g.trace_id,
+        'callback': stats['callback'],
+        'status': stats['status'],
+        'duration': round(stats['duration'], 6),
+        'response_bytes': size,
+        'bytes_read': stats['bytes_read'],
+        'cache': stats['cache']}))
+    return response
+
+
+def get_labels_text(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join(
+        '%s="%s"' % (key, str(value).replace('"', '\\"'))
+        for key, value in labels)
+
+
+def render_metrics():
+    # Prometheus text exposition format. Metrics are per process, so every
+    # worker of a multi-process server has to be scraped separately.
+    with METRICS_LOCK:
+        counters = dict(COUNTERS)
+        histograms = {key: (list(value[0]), value[1], value[2])
+                      for key, value in HISTOGRAMS.items()}
+
+    lines = []
+    for name, (metric_type, description) in HELP.items():
+        lines.append('# HELP %s %s' % (name, description))
+        lines.append('# TYPE %s %s' % (name, metric_type))
+        for (key, labels), value in sorted(counters.items()):
+            if key == name:
+                lines.append('%s%s %s' % (
+                    name, get_labels_text(labels), repr(value)))
+        for (key, labels), (counts, total, buckets) in sorted(
+                histograms.items()):
+            if key != name:
+                continue
+            cumulative = 0
+            for bound, count in zip(buckets + ('+Inf',), counts):
+                cumulative += count
+                lines.append('%s_bucket%s %d' % (
+                    name, get_labels_text(labels + (('le', bound),)),
+                    cumulative))
+            lines.append('%s_sum%s %s' % (
+                name, get_labels_text(labels), repr(total)))
+            lines.append('%s_count%s %d' % (
+                name, get_labels_text(labels), cumulative))
+    return '\n'.join(lines) + '\n'
+
+
+def init_metrics(server):
+    if not LOGGER.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        LOGGER.addHandler(handler)
+        LOGGER.setLevel(logging.INFO)
+
+    server.before_request(start_request)
+    server.after_request(finish_request)
+    server.add_url_rule(
+        '/metrics', 'metrics', lambda: flask.Response(
+            render_metrics(), mimetype='text/plain; version=0.0.4'))
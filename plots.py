@@ -1,4 +1,6 @@
 import os
+import base64
+
 import numpy as np
 import pandas as pd
 
@@ -6,19 +8,48 @@ import plotly.express as px
 from plotly.subplots import make_subplots
 import plotly.graph_objs as go
 
-from gmprocess.waveform_processing import spectrum
-from gmprocess.io.asdf.stream_workspace import StreamWorkspace
 from gmprocess.io.fetch_utils import PASSED_COLOR, FAILED_COLOR
 
-from constants import MAPBOX_ACCESS_TOKEN, NPTS, AZIMUTH, DIST_DICT
-from utils import evaluate_model, manage_imts
-
-
-def get_db_map_figure(df, lat_col, lon_col, hover_col, color_col, title):
-
-    if any([val is None for val in locals().values()]):
+from constants import (MAPBOX_ACCESS_TOKEN, NPTS, AZIMUTH, DIST_DICT,
+                       REC_PLOT_WIDTH, DEFAULT_MAP_ZOOM, CLUSTER_MAX_ZOOM,
+                       CLUSTER_MIN_POINTS, CLUSTER_CELLS, WEBGL_THRESHOLD,
+                       ENCODE_TYPED_ARRAYS, DEFAULT_NBINS)
+from stats import (get_sorted_values, get_sorted_counts, get_bin_edges,
+                   get_cumulative_counts, get_exceedance_counts,
+                   get_histogram)
+from utils import (evaluate_models, get_residual_stats, manage_imts,
+                   get_rec_data, decimate_minmax, get_eq_imc_df,
+                   get_eq_full_status_df, get_event_version)
+from cache import get_file_signature
+from figures import get_cached_figure
+from residuals import get_residuals, get_residual_components, get_vs30_column
+from stations import (get_station_version, get_station_records,
+                      get_station_status, get_station_residuals)
+
+
+def get_db_map_figure(df, lat_col, lon_col, hover_col, color_col, title,
+                      view=None, cluster=False):
+
+    if any([val is None for val in
+            [df, lat_col, lon_col, hover_col, color_col, title]]):
         return {'data': None, 'layout': None}
 
+    # The station table has a row per record (it is merged with the
+    # metrics), so points are deduplicated before they are filtered,
+    # counted into clusters or drawn
+    df = df.drop_duplicates(hover_col)
+    layout = get_map_layout(df, lat_col, lon_col, title, view)
+
+    # In cluster mode only the points inside the current viewport are
+    # shipped, aggregated on a grid until the user zooms in far enough.
+    if cluster:
+        df = get_df_in_view(df, lat_col, lon_col, view)
+        zoom = view[0] if view else DEFAULT_MAP_ZOOM
+        if zoom < CLUSTER_MAX_ZOOM and df.shape[0] > CLUSTER_MIN_POINTS:
+            return {'data': get_map_cluster_traces(
+                df, lat_col, lon_col, hover_col, color_col, zoom),
+                'layout': layout}
+
     data = [
         go.Scattermapbox(
             lat=df[lat_col],
@@ -88,26 +119,109 @@ def get_db_map_figure(df, lat_col, lon_col, hover_col, color_col, title):
                 color=colors,
                 colorbar=dict(title=color_col),
                 colorscale='Plasma')))
-    layout = go.Layout(
+    return {'data': data, 'layout': layout}
+
+
+def get_map_layout(df, lat_col, lon_col, title, view):
+    if view is None:
+        zoom, center = DEFAULT_MAP_ZOOM, dict(
+            lat=df[lat_col].mean(), lon=df[lon_col].mean())
+    else:
+        zoom, center = view[0], dict(lat=view[1], lon=view[2])
+    return go.Layout(
         mapbox=dict(
             accesstoken=MAPBOX_ACCESS_TOKEN,
-            center=dict(
-                lat=df[lat_col].mean(),
-                lon=df[lon_col].mean()),
+            center=center,
             style='stamen-terrain',
             bearing=0,
-            zoom=5,
+            zoom=zoom,
         ),
         title=title,
         autosize=True,
+        uirevision=title,
         margin={'b': 0, 't': 50, 'l': 0, 'r': 150})
 
-    return {'data': data, 'layout': layout}
+
+def get_map_view(relayout_data):
+    # Returns a hashable (zoom, center lat, center lon, bounds) tuple for the
+    # map viewport, or None when the user has not moved the map yet.
+    if not relayout_data or 'mapbox.zoom' not in relayout_data:
+        return None
+    center = relayout_data.get('mapbox.center', {})
+    bounds = None
+    coords = relayout_data.get('mapbox._derived', {}).get('coordinates')
+    if coords:
+        lons, lats = zip(*coords)
+        bounds = (min(lats), max(lats), min(lons), max(lons))
+    return (relayout_data['mapbox.zoom'], center.get('lat'),
+            center.get('lon'), bounds)
+
+
+def get_df_in_view(df, lat_col, lon_col, view):
+    if view is None or view[3] is None:
+        return df
+    lat_min, lat_max, lon_min, lon_max = view[3]
+    return df[df[lat_col].between(lat_min, lat_max) &
+              df[lon_col].between(lon_min, lon_max)]
+
+
+def get_map_cluster_traces(df, lat_col, lon_col, hover_col, color_col, zoom):
+    # Points are binned on a lat/lon grid whose cell size halves with every
+    # zoom level. Pass/fail counts are summed and percentages are recomputed
+    # from the sums rather than averaged.
+    cell = 360.0 / 2 ** np.floor(zoom) / CLUSTER_CELLS
+    grouped = df.groupby([np.floor(df[lat_col] / cell).values,
+                          np.floor(df[lon_col] / cell).values])
+    clusters = pd.DataFrame({
+        'lat': grouped[lat_col].mean(),
+        'lon': grouped[lon_col].mean(),
+        'count': grouped.size(),
+        'passed': grouped['Number of passed records'].sum(),
+        'total': grouped['Number of total records'].sum()})
+    if color_col == 'Percentage of passed records':
+        clusters['color'] = 100 * clusters['passed'] / clusters['total']
+    elif color_col == 'Percentage of failed records':
+        clusters['color'] = 100 * (
+            1 - clusters['passed'] / clusters['total'])
+    else:
+        clusters['color'] = grouped[color_col].mean()
+
+    sizes = 10 + 4 * np.log2(clusters['count'].values)
+    kind = 'events' if hover_col == 'id' else 'stations'
+    customdata = np.dstack((
+        np.full(clusters.shape[0], ''),
+        clusters['count'],
+        clusters['passed'],
+        clusters['total']))[0]
+    return [
+        go.Scattermapbox(
+            lat=clusters['lat'],
+            lon=clusters['lon'],
+            mode='markers',
+            showlegend=False,
+            hoverinfo='skip',
+            marker=go.scattermapbox.Marker(
+                size=sizes + 2,
+                color='rgb(0, 0, 0)')),
+        go.Scattermapbox(
+            lat=clusters['lat'],
+            lon=clusters['lon'],
+            mode='markers',
+            showlegend=False,
+            customdata=customdata,
+            hovertemplate=(
+                "%{customdata[1]} " + kind + "<br>"
+                "Records passed: %{customdata[2]} / %{customdata[3]}<br>"
+                "" + color_col + ": %{marker.color:.4g}<extra></extra>"),
+            marker=go.scattermapbox.Marker(
+                size=sizes,
+                color=clusters['color'],
+                colorbar=dict(title=color_col),
+                colorscale='Plasma'))]
 
 
 def get_db_net_bar_figure(df, net_bar_select):
-    df.sort_values(
-        by=net_bar_select, inplace=True, ascending=True)
+    df = df.sort_values(by=net_bar_select, ascending=True)
     fig = px.bar(df, x=net_bar_select, y='Network', orientation='h')
     return fig
 
@@ -122,28 +236,26 @@ def get_db_fail_bar_figure(df):
     return fig
 
 
-def get_db_scatter_figure(df, db_scatter_x, db_scatter_y, db_scatter_c):
+def get_db_scatter_figure(df, db_scatter_x, db_scatter_y, db_scatter_c,
+                          nbins=DEFAULT_NBINS, log_bins=False, key=None):
 
     if db_scatter_y == 'Cumulative exceedance':
         if 'Distance' in db_scatter_x:
-            ranges = np.linspace(0, df[db_scatter_x].max(), 300)
-            yvals = df.groupby(pd.cut(
-                df[db_scatter_x], ranges)).count()['EarthquakeId'].cumsum()
-        elif db_scatter_x == 'Number of records per event':
-            ranges = np.linspace(
-                0, df['EarthquakeId'].value_counts().max(), 300)
-            yvals = yvals = [
-                (df['EarthquakeId'].value_counts() > val).sum()
-                for val in ranges]
-        elif db_scatter_x == 'Number of records per station':
-            ranges = np.linspace(
-                0, df['StationID'].value_counts().max(), 300)
-            yvals = yvals = [
-                (df['StationID'].value_counts() > val).sum() for val in ranges]
+            values = get_sorted_values(df, db_scatter_x, key)
+            ranges = get_bin_edges(values, nbins, log_bins)
+            yvals = get_cumulative_counts(values, ranges)
+        else:
+            if db_scatter_x == 'Number of records per event':
+                counts = get_sorted_counts(df, 'EarthquakeId', key)
+            elif db_scatter_x == 'Number of records per station':
+                counts = get_sorted_counts(df, 'StationID', key)
+            ranges = get_bin_edges(counts, nbins, log_bins)
+            yvals = get_exceedance_counts(counts, ranges)
         fig = go.Figure(go.Scatter(x=ranges, y=yvals, mode='lines'))
         fig.update_layout(
             xaxis_title=db_scatter_x,
-            yaxis_title=db_scatter_y
+            yaxis_title=db_scatter_y,
+            xaxis_type='log' if log_bins else 'linear'
         )
     elif db_scatter_y == 'Count':
         if db_scatter_x == 'BackAzimuth':
@@ -151,78 +263,165 @@ def get_db_scatter_figure(df, db_scatter_x, db_scatter_y, db_scatter_c):
             fig = go.Figure(go.Barpolar(r=vals, theta=centers))
             fig.update_layout(polar=dict(angularaxis=dict(
                 rotation=90, direction='clockwise')))
+        elif use_webgl(df) and np.issubdtype(
+                df[db_scatter_x].dtype, np.number):
+            # Large numeric histograms are binned here so that only the bin
+            # counts are sent to the browser
+            edges, counts = get_histogram(
+                get_sorted_values(df, db_scatter_x, key), nbins, log_bins)
+            fig = go.Figure(go.Bar(
+                x=(edges[:-1] + edges[1:]) / 2, y=counts,
+                width=np.diff(edges)))
+            fig.update_layout(
+                xaxis_title=db_scatter_x,
+                yaxis_title=db_scatter_y,
+                xaxis_type='log' if log_bins else 'linear',
+                bargap=0)
         else:
             fig = px.histogram(df, x=db_scatter_x)
     else:
         fig = px.scatter(df, x=db_scatter_x, y=db_scatter_y,
-                         color=db_scatter_c)
+                         color=db_scatter_c,
+                         render_mode='webgl' if use_webgl(df) else 'svg')
         fig.update_traces(marker=dict(
             size=10, line=dict(width=1, color='DarkSlateGrey')))
+    if use_webgl(df):
+        return get_compact_figure(fig)
     return fig
 
 
-def get_rec_plot(eqid, stid, wdir):
-
-    ws = StreamWorkspace.open(os.path.join(wdir, eqid, 'workspace.h5'))
-    labels = ws.getLabels()
-    labels.remove('unprocessed')
-
-    station = stid.split('.')[1]
+def use_webgl(df):
+    return df is not None and df.shape[0] > WEBGL_THRESHOLD
+
+
+def encode_array(values, dtype='f4'):
+    # plotly.js (>= 2.28) accepts typed arrays as base64-encoded buffers,
+    # which are several times smaller than JSON float lists and skip the
+    # client-side parsing of every number. Older versions would not draw
+    # them, so plain arrays are returned unless ENCODE_TYPED_ARRAYS is set.
+    values = np.asarray(values)
+    if not ENCODE_TYPED_ARRAYS or not np.issubdtype(values.dtype, np.number):
+        return values
+    return {'dtype': dtype,
+            'bdata': base64.b64encode(
+                values.astype(dtype).tobytes()).decode('ascii')}
+
+
+def get_compact_figure(fig):
+    fig = fig.to_plotly_json()
+    for trace in fig['data']:
+        for attr in ['x', 'y', 'r', 'theta']:
+            if trace.get(attr) is not None:
+                trace[attr] = encode_array(trace[attr])
+        marker = trace.get('marker', {})
+        if np.ndim(marker.get('color')) == 1:
+            marker['color'] = encode_array(marker['color'])
+    return fig
 
-    r_st = ws.getStreams(
-        eqid, stations=[station], labels=['unprocessed'])[0]
 
-    if labels:
-        p_st = ws.getStreams(eqid, stations=[station], labels=[labels[0]])[0]
-        v_st = p_st.copy().integrate()
+def get_eq_marker_trace(x, y, labels, name=None, showlegend=False,
+                        label_key='stations'):
+    marker = dict(
+        size=10,
+        line=dict(
+            color='black',
+            width=1))
+    if len(x) <= WEBGL_THRESHOLD:
+        return go.Scatter(
+            x=x,
+            y=y,
+            mode='markers',
+            hovertext=labels,
+            hoverinfo='text',
+            name=name,
+            showlegend=showlegend,
+            marker=marker)
+
+    # Large figures are drawn with WebGL from typed arrays. Instead of
+    # repeating the labels in every trace, each point carries the position
+    # of its label in the sorted unique labels (see get_label_list), which
+    # are sent once alongside the figures under label_key. The browser
+    # fills in the hover text from them (label_figures).
+    codes = np.unique(np.asarray(labels, dtype=str), return_inverse=True)[1]
+    return {
+        'type': 'scattergl',
+        'x': encode_array(x),
+        'y': encode_array(y),
+        'customdata': encode_array(codes, 'i4'),
+        'meta': label_key,
+        'mode': 'markers',
+        'hovertemplate': '%{text}<br>%{x:.4g}, %{y:.4g}<extra></extra>',
+        'name': name,
+        'showlegend': showlegend,
+        'marker': marker}
+
+
+def get_label_list(labels):
+    return np.unique(np.asarray(labels, dtype=str)).tolist()
+
+
+def decode_array(values):
+    if isinstance(values, dict):
+        return np.frombuffer(base64.b64decode(values['bdata']),
+                             values['dtype'])
+    return np.asarray(values)
+
+
+def label_figure(fig, labels):
+    # Python reference of the clientside label_figures: the hover text of
+    # WebGL traces is looked up from the labels sent with the figures
+    if not fig or not fig.get('data') or not labels:
+        return fig
+    data = []
+    for trace in fig['data']:
+        if trace.get('meta') in labels and trace.get('customdata') is not None:
+            names = labels[trace['meta']]
+            trace = dict(trace, text=[
+                names[code] for code in decode_array(trace['customdata'])])
+        data.append(trace)
+    return dict(fig, data=data)
+
+
+def get_rec_plot(eqid, stid, wdir, relayout_data=None):
+    # Time series are decimated to roughly two points per pixel column.
+    # When the user zooms into the time series, only the visible window is
+    # decimated so that detail is recovered at every zoom level.
+    rec_data = get_rec_data(eqid, stid, wdir)
+    time_range = get_rec_time_range(relayout_data, len(rec_data))
+    max_points = 2 * REC_PLOT_WIDTH // len(rec_data)
 
     fig = make_subplots(
-        rows=5, cols=len(r_st))
+        rows=5, cols=len(rec_data))
 
     shapes = []
 
-    for tr_idx, r_tr in enumerate(r_st):
-        p_tr, v_tr = p_st[tr_idx], v_st[tr_idx]
-        x_start = p_tr.stats.starttime - r_tr.stats.starttime
-        x_end = p_tr.stats.endtime - r_tr.stats.starttime
-        sig_dict = p_tr.getCached('signal_spectrum')
-        noi_dict = p_tr.getCached('noise_spectrum')
-        sig_dict_s = p_tr.getCached('smooth_signal_spectrum')
-        noi_dict_s = p_tr.getCached('smooth_noise_spectrum')
-        snr_dict = p_tr.getCached('snr')
-        sig_spec, sig_freq = sig_dict['spec'], sig_dict['freq']
-        noi_spec, noi_freq = noi_dict['spec'], noi_dict['freq']
-        sig_spec_s, sig_freq_s = sig_dict_s['spec'], sig_dict_s['freq']
-        noi_spec_s, noi_freq_s = noi_dict_s['spec'], noi_dict_s['freq']
-        snr, snr_freq = snr_dict['snr'], snr_dict['freq']
-        snr_conf = p_tr.getParameter('snr_conf')
-        threshold = snr_conf['threshold']
-        min_freq, max_freq = snr_conf['min_freq'], snr_conf['max_freq']
-        lp = p_tr.getProvenance('lowpass_filter')[0]['corner_frequency']
-        hp = p_tr.getProvenance('highpass_filter')[0]['corner_frequency']
-        fit_spectra_dict = p_tr.getParameter('fit_spectra')
-        f0 = fit_spectra_dict['f0']
-        model_spec = spectrum.model(
-            (fit_spectra_dict['moment'], fit_spectra_dict['stress_drop']),
-            freq=np.array(sig_freq_s),
-            dist=fit_spectra_dict['epi_dist'],
-            kappa=fit_spectra_dict['kappa'])
+    for tr_idx, tr_data in enumerate(rec_data):
+        sig_freq, sig_spec = tr_data['sig_freq'], tr_data['sig_spec']
+        snr_freq, snr = tr_data['snr_freq'], tr_data['snr']
 
         scatter_data = [
-            [r_tr.times(), r_tr.data, 'black', None, 1],
-            [p_tr.times(), p_tr.data, 'black', None, 2],
-            [v_tr.times(), v_tr.data, 'black', None, 3],
+            decimate_window(tr_data['raw_times'], tr_data['raw_data'],
+                            time_range, max_points) + ['black', None, 1],
+            decimate_window(tr_data['proc_times'], tr_data['proc_data'],
+                            time_range, max_points) + ['black', None, 2],
+            decimate_window(tr_data['vel_times'], tr_data['vel_data'],
+                            time_range, max_points) + ['black', None, 3],
             [sig_freq, sig_spec, 'lightblue', None, 4],
-            [sig_freq_s, sig_spec_s, 'blue', None, 4],
-            [noi_freq, noi_spec, 'salmon', None, 4],
-            [noi_freq_s, noi_spec_s, 'red', None, 4],
-            [sig_freq_s, model_spec, 'black', 'dash', 4],
+            [tr_data['sig_freq_s'], tr_data['sig_spec_s'], 'blue', None, 4],
+            [tr_data['noi_freq'], tr_data['noi_spec'], 'salmon', None, 4],
+            [tr_data['noi_freq_s'], tr_data['noi_spec_s'], 'red', None, 4],
+            [tr_data['sig_freq_s'], tr_data['model_spec'], 'black', 'dash',
+             4],
             [snr_freq, snr, 'black', None, 5]]
 
+        raw_min, raw_max = tr_data['raw_min'], tr_data['raw_max']
+        threshold = tr_data['threshold']
+        f0, lp, hp = tr_data['f0'], tr_data['lp'], tr_data['hp']
+        min_freq, max_freq = tr_data['min_freq'], tr_data['max_freq']
         line_data = [
-            [x_start, r_tr.data.min(), x_start, r_tr.data.max(), 'red',
+            [tr_data['x_start'], raw_min, tr_data['x_start'], raw_max, 'red',
              'dash', 1],
-            [x_end, r_tr.data.min(), x_end, r_tr.data.max(), 'red',
+            [tr_data['x_end'], raw_min, tr_data['x_end'], raw_max, 'red',
              'dash', 1],
             [f0, 1e-10, f0, sig_spec.max(), 'black', 'dash', 4],
             [snr_freq.min(), threshold, snr_freq.max(), threshold, 'gray',
@@ -240,7 +439,7 @@ def get_rec_plot(eqid, stid, wdir):
                 row=scatter[4], col=tr_idx + 1)
 
         for line in line_data:
-            i_ref = len(r_st) * (line[6] - 1) + tr_idx + 1
+            i_ref = len(rec_data) * (line[6] - 1) + tr_idx + 1
             shapes.append({
                 'type': 'line',
                 'x0': line[0],
@@ -252,6 +451,11 @@ def get_rec_plot(eqid, stid, wdir):
                 'line': {'color': line[4], 'dash': line[5]}})
 
     fig.update_xaxes(title_text='Time (s)')
+    for row in range(1, 4):
+        # Zooming any time series zooms all of them
+        fig.update_xaxes(row=row, matches='x')
+        if time_range is not None:
+            fig.update_xaxes(row=row, range=time_range)
     fig.update_yaxes(row=1, col=1, title_text='Raw counts')
     fig.update_yaxes(row=2, col=1, title_text='Acceleration (cm/s^2)')
     fig.update_yaxes(row=3, col=1, title_text='Velocity (cm/s)')
@@ -261,45 +465,110 @@ def get_rec_plot(eqid, stid, wdir):
     fig.update_xaxes(row=5, title_text='Frequency (Hz)', type='log')
     fig.update_yaxes(row=5, col=1, title_text='SNR', type='log')
     fig.update_yaxes(row=5, type='log')
-    fig.update_layout(showlegend=False)
+    fig.update_layout(showlegend=False, uirevision='%s %s' % (eqid, stid))
     fig['layout'].update(shapes=shapes,
                          margin={'b': 0, 't': 0, 'l': 0, 'r': 30})
 
-    ws.close()
-
     return fig
 
 
-def get_eq_moveout_resid_figs(df, dist, imt, mod, site_params, rup_params):
+def get_rec_plot_job_key(eqid, stid, wdir, version, relayout_data=None):
+    # Shared by the record tab and prefetching, so that a prefetched record
+    # plot is the job the record tab finds when the record is selected
+    relayout_key = tuple(sorted(
+        (key, repr(value)) for key, value in (relayout_data or {}).items()))
+    return ('rec_plot', eqid, stid, wdir, relayout_key, repr(version))
+
+
+def build_rec_plot(eqid, stid, wdir, relayout_data=None, progress=None):
+    # Background job version of get_rec_plot. Returns None when a relayout
+    # does not change the time window, so the current figure is kept.
+    # Figures are cached on the workspace signature and the relayout.
+    path = os.path.join(wdir, eqid, 'workspace.h5')
+    key = (eqid, stid, wdir, get_file_signature(path), tuple(sorted(
+        (name, repr(value)) for name, value in (relayout_data or {}).items())))
+    return get_cached_figure('rec_plot', key, lambda: get_rec_plot_window(
+        eqid, stid, wdir, relayout_data, progress))
+
+
+def get_rec_plot_window(eqid, stid, wdir, relayout_data, progress):
+    progress(0, 'Reading workspace')
+    rec_data = get_rec_data(eqid, stid, wdir)
+    if relayout_data is not None and not is_rec_time_relayout(
+            relayout_data, len(rec_data)):
+        return None
+    progress(0.5, 'Building figure')
+    return get_rec_plot(eqid, stid, wdir, relayout_data)
+
+
+def get_rec_time_axes(ntraces):
+    # Subplot axes are numbered row by row, and the time series occupy the
+    # first three rows.
+    return ['xaxis' if idx == 1 else 'xaxis%d' % idx
+            for idx in range(1, 3 * ntraces + 1)]
+
+
+def get_rec_time_range(relayout_data, ntraces):
+    if not relayout_data:
+        return None
+    for axis in get_rec_time_axes(ntraces):
+        if '%s.range[0]' % axis in relayout_data:
+            return [relayout_data['%s.range[0]' % axis],
+                    relayout_data['%s.range[1]' % axis]]
+        if '%s.range' % axis in relayout_data:
+            return relayout_data['%s.range' % axis]
+    return None
+
+
+def is_rec_time_relayout(relayout_data, ntraces):
+    # Only zooming, panning or resetting a time series requires a new
+    # window; other relayouts (e.g. zooming a spectrum) are left alone.
+    if not relayout_data:
+        return False
+    prefixes = tuple('%s.' % axis for axis in get_rec_time_axes(ntraces))
+    return any(key.startswith(prefixes) for key in relayout_data)
+
+
+def decimate_window(times, data, time_range, max_points):
+    if time_range is not None:
+        start, stop = np.searchsorted(times, time_range)
+        # Keep one sample on either side so lines reach the plot edges
+        start, stop = max(start - 1, 0), min(stop + 1, len(times))
+        times, data = times[start:stop], data[start:stop]
+    return list(decimate_minmax(times, data, max_points))
+
+
+def get_eq_moveout_resid_figs(df, dist, imt, mods, site_params, rup_params):
     if df is None or dist is None or imt is None or imt == 'Pass/Fail':
-        return [{'data': None, 'layout': None}] * 3
+        return [{'data': None, 'layout': None}] * 3 + [{}]
 
-    data = [go.Scatter(
-        x=df[dist],
-        y=df[imt],
-        mode='markers',
-        hovertext=df['StationID'],
-        hoverinfo='text',
-        showlegend=False,
-        marker=dict(
-            size=10,
-            line=dict(
-                color='black',
-                width=1)))]
+    data = [get_eq_marker_trace(df[dist], df[imt], df['StationID'])]
 
     data_m = []
     data_h = []
+    stats = {}
+
+    if mods:
+        results = evaluate_models(
+            site_params, rup_params, df, NPTS, AZIMUTH, mods, imt)
+    else:
+        results = {}
+
+    # Models are overlaid in comparison mode, so the residual traces only
+    # get legend entries when there is more than one of them.
+    compare = len(mods or []) > 1
 
-    if mod:
-        mean_moveout, dx = evaluate_model(
-            site_params, rup_params, df, NPTS, AZIMUTH, True, mod, imt)
-        mean_resid, sd = evaluate_model(
-            site_params, rup_params, df, NPTS, AZIMUTH, False, mod, imt)
+    for mod in mods or []:
+        if results[mod] is None:
+            stats[mod] = None
+            continue
+        moveout, mean_moveout, mean_resid, sd = results[mod]
 
         resid = (np.log(df[imt]) - np.log(mean_resid)) / sd
+        stats[mod] = get_residual_stats(df[imt], mean_resid, sd)
 
         data.append(go.Scatter(
-            x=getattr(dx, DIST_DICT[dist][0]),
+            x=moveout[DIST_DICT[dist][0]],
             y=mean_moveout,
             mode='lines',
             hoverinfo='text',
@@ -308,20 +577,13 @@ def get_eq_moveout_resid_figs(df, dist, imt, mod, site_params, rup_params):
         )
         )
 
-        data_m.append(go.Scatter(
-            x=df[dist],
-            y=resid,
-            mode='markers',
-            hovertext=df['StationID'],
-            hoverinfo='text',
-            showlegend=False,
-            marker=dict(
-                size=10,
-                line=dict(
-                    color='black',
-                    width=1))))
+        data_m.append(get_eq_marker_trace(
+            df[dist], resid, df['StationID'], mod, compare))
 
-        data_h.append(go.Histogram(x=resid))
+        data_h.append(dict(
+            type='histogram', x=encode_array(resid) if use_webgl(df) else
+            resid, name=mod, showlegend=compare,
+            opacity=0.6 if compare else 1))
 
     layout = go.Layout(
         xaxis={'type': 'log', 'title': DIST_DICT[dist][1]},
@@ -334,9 +596,211 @@ def get_eq_moveout_resid_figs(df, dist, imt, mod, site_params, rup_params):
         hovermode='closest')
     layout_h = go.Layout(
         xaxis={'title': '(ln(obs) - ln(GMPE)) / sigma'},
-        yaxis={'title': 'Count'}
+        yaxis={'title': 'Count'},
+        barmode='overlay'
     )
 
     return ({'data': data, 'layout': layout},
             {'data': data_m, 'layout': layout_m},
-            {'data': data_h, 'layout': layout_h})
+            {'data': data_h, 'layout': layout_h},
+            stats)
+
+
+def build_eq_figures(wdir, proj, label, imc, imt, eqid, dist, mods,
+                     site_params, rup_params, progress=None):
+    # Background job behind the event tab figures. Returns the map, moveout,
+    # residual and histogram figures, the residual statistics of each model
+    # and the station ids of WebGL figures, cached on the inputs and the
+    # versions of the event's files.
+    key = (wdir, proj, label, imc, imt, eqid, dist, mods, site_params,
+           rup_params, get_event_version(wdir, proj, label, eqid, imc))
+    return get_cached_figure('eq_figures', key, lambda: get_eq_figures(
+        wdir, proj, label, imc, imt, eqid, dist, mods, site_params,
+        rup_params, progress))
+
+
+def get_eq_figures(wdir, proj, label, imc, imt, eqid, dist, mods,
+                   site_params, rup_params, progress):
+    progress(0, 'Reading records')
+    if imt == 'Pass/Fail':
+        df = get_eq_full_status_df(wdir, eqid, imc)
+    else:
+        df = get_eq_imc_df(wdir, proj, label, eqid, imc)
+
+    eq_map_fig = get_db_map_figure(
+        df, 'StationLatitude', 'StationLongitude', 'StationID', imt, '')
+
+    progress(0.3, 'Evaluating models')
+    eq_moveout_fig, eq_resid_fig, eq_hist, stats = get_eq_moveout_resid_figs(
+        df, dist, imt, mods, site_params, rup_params)
+
+    # Station ids of WebGL figures are sent once, for their hover text and
+    # click routing
+    if imt != 'Pass/Fail' and use_webgl(df):
+        labels = {'stations': get_label_list(df['StationID'])}
+    else:
+        labels = None
+
+    return eq_map_fig, eq_moveout_fig, eq_resid_fig, eq_hist, stats, labels
+
+
+def get_st_amplitude_figure(df, x, imt, color, log_x=True):
+    if df is None or df.empty or x is None or imt not in df.columns or (
+            color not in df.columns):
+        return {'data': None, 'layout': None}
+    fig = go.Figure(go.Scatter(
+        x=df[x],
+        y=df[imt],
+        mode='markers',
+        hovertext=df['EarthquakeId'],
+        hoverinfo='text+x+y',
+        marker=dict(color=df[color], colorscale='Plasma',
+                    colorbar=dict(title=color))))
+    fig.update_layout(
+        xaxis={'type': 'log' if log_x else 'linear', 'title': x},
+        yaxis={'type': 'log', 'title': manage_imts(imt)[1]},
+        hovermode='closest')
+    return fig
+
+
+def get_st_pass_rate_figure(df):
+    if df is None or df.empty:
+        return {'data': None, 'layout': None}
+    rate = 100 * df['Passed'].cumsum() / np.arange(1, df.shape[0] + 1)
+    fig = go.Figure([
+        go.Scatter(x=df['time'], y=rate, mode='lines', name='Pass rate',
+                   showlegend=False),
+        go.Scatter(
+            x=df['time'],
+            y=np.where(df['Passed'], 100, 0),
+            mode='markers',
+            showlegend=False,
+            hovertext=df['EarthquakeId'] + ': ' + df[
+                'Failure reason'].fillna('Passed'),
+            hoverinfo='text+x',
+            marker=dict(color=[PASSED_COLOR if passed else FAILED_COLOR
+                               for passed in df['Passed']]))])
+    fig.update_layout(
+        xaxis_title='Event time',
+        yaxis={'title': 'Cumulative percentage of passed records',
+               'range': [-5, 105]},
+        hovermode='closest')
+    return fig
+
+
+def get_st_site_term_figure(resid, mod):
+    # Within-event residuals of the station against magnitude, with its
+    # site term from the database-wide decomposition
+    if resid is None or resid.empty:
+        return {'data': None, 'layout': None}
+    site_term = resid['Site term'].iloc[0]
+    fig = go.Figure(go.Scatter(
+        x=resid['EarthquakeMagnitude'],
+        y=resid['Within-event residual'],
+        mode='markers',
+        hovertext=resid['EarthquakeId'],
+        hoverinfo='text+x+y',
+        showlegend=False))
+    fig.update_layout(
+        shapes=[dict(type='line', xref='paper', x0=0, x1=1, y0=site_term,
+                     y1=site_term, line=dict(dash='dash'))],
+        title='%s site term: %.3f (std. dev. %.3f)' % (
+            mod, site_term,
+            np.std(resid['Single-station within-event residual'])),
+        xaxis_title='Magnitude',
+        yaxis_title='Within-event residual',
+        hovermode='closest')
+    return fig
+
+
+def build_st_figures(wdir, proj, label, imc, stid, imt, dist, mod,
+                     progress=None):
+    # Background job behind the station figures, cached on the inputs and
+    # the versions of the project and metrics files
+    key = (wdir, proj, label, imc, stid, imt, dist, mod,
+           get_station_version(wdir, proj, label, imc))
+    return get_cached_figure('st_figures', key, lambda: get_st_figures(
+        wdir, proj, label, imc, stid, imt, dist, mod, progress))
+
+
+def get_st_figures(wdir, proj, label, imc, stid, imt, dist, mod, progress):
+    progress(0, 'Reading station records')
+    df = get_station_records(wdir, proj, label, imc, stid)
+    df_status = get_station_status(wdir, proj, label, imc, stid)
+    resid = None
+    if mod and imt in df.columns:
+        resid = get_station_residuals(wdir, proj, label, imc, stid, imt,
+                                      mod, progress)
+    return (get_st_amplitude_figure(df, dist, imt, 'EarthquakeMagnitude'),
+            get_st_amplitude_figure(df, 'EarthquakeMagnitude', imt, dist,
+                                    log_x=False),
+            get_st_pass_rate_figure(df_status),
+            get_st_site_term_figure(resid, mod))
+
+
+def build_resid_figures(wdir, proj, label, imc, imt, dist, mod,
+                        progress=None):
+    # Background job behind the database residual figures, cached on the
+    # inputs and the version of the metrics file
+    metrics_file = os.path.join(
+        wdir, '%s_%s_metrics_%s.csv' % (proj, label, imc))
+    key = (wdir, proj, label, imc, imt, dist, mod,
+           get_file_signature(metrics_file))
+    return get_cached_figure('resid_figures', key, lambda: get_resid_figures(
+        wdir, proj, label, imc, imt, dist, mod, progress))
+
+
+def get_resid_figures(wdir, proj, label, imc, imt, dist, mod, progress):
+    progress(0, 'Reading records')
+    df = get_residuals(wdir, proj, label, imc, imt, mod, progress)
+    progress(0.95, 'Building figures')
+    components = get_residual_components(df)
+    labels = {'stations': get_label_list(df['StationID']),
+              'events': get_label_list(df['EarthquakeId'])}
+    return (get_db_resid_mag_figure(df, components),
+            get_db_resid_dist_figure(df, dist, components),
+            get_db_resid_site_figure(df, components), labels)
+
+
+def get_db_resid_mag_figure(df, components):
+    df_eq = df.drop_duplicates('EarthquakeId')
+    layout = go.Layout(
+        title='Between-event residuals (tau = %.3f, bias = %.3f)' % (
+            components['tau'], components['bias']),
+        xaxis={'title': 'Magnitude'},
+        yaxis={'title': 'Between-event residual (ln units)'},
+        hovermode='closest')
+    return {'data': [get_eq_marker_trace(
+        df_eq['EarthquakeMagnitude'], df_eq['Between-event residual'],
+        df_eq['EarthquakeId'], label_key='events')], 'layout': layout}
+
+
+def get_db_resid_dist_figure(df, dist, components):
+    layout = go.Layout(
+        title='Within-event residuals (phi = %.3f)' % components['phi'],
+        xaxis={'type': 'log', 'title': DIST_DICT[dist][1]},
+        yaxis={'title': 'Within-event residual (ln units)'},
+        hovermode='closest')
+    return {'data': [get_eq_marker_trace(
+        df[dist], df['Within-event residual'], df['StationID'])],
+        'layout': layout}
+
+
+def get_db_resid_site_figure(df, components):
+    # Site terms against vs30 when the metrics provide station vs30 values,
+    # otherwise per station ranked by site term
+    df_st = df.drop_duplicates('StationID')
+    vs30_col = get_vs30_column(df_st)
+    if vs30_col:
+        x, xaxis = df_st[vs30_col], {'type': 'log', 'title': 'Vs30 (m/s)'}
+    else:
+        df_st = df_st.sort_values('Site term')
+        x, xaxis = np.arange(df_st.shape[0]), {'title': 'Station rank'}
+    layout = go.Layout(
+        title='Site terms (phiS2S = %.3f, phiSS = %.3f)' % (
+            components['phi_s2s'], components['phi_ss']),
+        xaxis=xaxis,
+        yaxis={'title': 'Site term (ln units)'},
+        hovermode='closest')
+    return {'data': [get_eq_marker_trace(
+        x, df_st['Site term'], df_st['StationID'])], 'layout': layout}
@@ -0,0 +1,37 @@
+import os
+
+from constants import PREFETCH_STATIONS
+from cache import get_optional_signature
+from jobs import submit_job
+from plots import build_rec_plot, get_rec_plot_job_key
+
+
+def rank_stations(df, imt):
+    # Failed records are the ones most often inspected, followed by the
+    # highest amplitudes and then the nearest stations.
+    if df is None or df.empty:
+        return []
+    keys = []
+    if 'Failure reason' in df.columns:
+        df = df.assign(failed=df['Failure reason'] != 'Passed')
+        keys.append(('failed', False))
+    if imt in df.columns:
+        keys.append((imt, False))
+    if 'EpicentralDistance' in df.columns:
+        keys.append(('EpicentralDistance', True))
+    if keys:
+        df = df.sort_values(by=[key[0] for key in keys],
+                            ascending=[key[1] for key in keys])
+    return list(df['StationID'].drop_duplicates()[:PREFETCH_STATIONS])
+
+
+def prefetch_records(wdir, eqid, stids, session_id):
+    # Record plots are built as background jobs with the same key the record
+    # tab uses, so selecting a prefetched record finds its job (or figure)
+    # already done. Each rank has its own slot per session: a new selection
+    # cancels the previous prefetch unless a record tab is waiting for it.
+    version = get_optional_signature(os.path.join(wdir, eqid, 'workspace.h5'))
+    for rank, stid in enumerate(stids):
+        submit_job(get_rec_plot_job_key(eqid, stid, wdir, version),
+                   ('prefetch', session_id, rank), build_rec_plot, eqid,
+                   stid, wdir)
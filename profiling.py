@@ -0,0 +1,152 @@
+import os
+import io
+import json
+import time
+import pstats
+import cProfile
+import threading
+from functools import wraps
+
+import flask
+
+from constants import (PROFILE_MODE, PROFILE_DIR, PROFILE_HEADER,
+                       PROFILE_RETENTION, PROFILE_LISTING)
+
+# Only one deterministic profiler can be active per process, so concurrent
+# requests that ask for a profile while another one is captured run
+# unprofiled.
+PROFILE_LOCK = threading.Lock()
+
+PROFILES_PAGE = '''<!DOCTYPE html>
+<html>
+<head><title>Callback profiles</title></head>
+<body>
+<h1>Slowest captured callbacks</h1>
+<table>
+<tr><th>Callback</th><th>Duration (s)</th><th>Captured</th>
+<th>Trace id</th><th></th></tr>
+{% for capture in captures %}
+<tr>
+<td>{{ capture.callback }}</td>
+<td>{{ '%.3f' % capture.duration }}</td>
+<td>{{ capture.captured }}</td>
+<td>{{ capture.trace_id }}</td>
+<td><a href="{{ url_for('profile_summary', name=capture.name) }}">summary</a>
+<a href="{{ url_for('profile_file', name=capture.name) }}">pstats</a></td>
+</tr>
+{% endfor %}
+</table>
+</body>
+</html>
+'''
+
+
+def should_profile():
+    # PROFILE_MODE is 'off', 'header' (requests opt in with the X-Profile
+    # header) or 'all'.
+    if PROFILE_MODE == 'all':
+        return True
+    return (PROFILE_MODE == 'header' and flask.has_request_context() and
+            flask.request.headers.get(PROFILE_HEADER, '0') not in
+            ['', '0', 'false'])
+
+
+def get_trace_id():
+    if flask.has_request_context():
+        return getattr(flask.g, 'trace_id', '')
+    return ''
+
+
+def profile_callback(func):
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        if not should_profile():
+            return func(*args, **kwargs)
+        return run_profiled(func, args, kwargs, get_trace_id())
+    return wrapper
+
+
+def run_profiled(func, args, kwargs, trace_id=''):
+    if not PROFILE_LOCK.acquire(blocking=False):
+        return func(*args, **kwargs)
+    try:
+        profile = cProfile.Profile()
+        start = time.perf_counter()
+        profile.enable()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profile.disable()
+            save_profile(profile, func.__name__,
+                         time.perf_counter() - start, trace_id)
+    finally:
+        PROFILE_LOCK.release()
+
+
+def save_profile(profile, callback, duration, trace_id=''):
+    # Every capture is a pstats file, readable by snakeviz or flameprof,
+    # next to a small JSON file with the data shown on the admin page.
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    name = '%d-%s' % (time.time_ns(), callback)
+    profile.dump_stats(os.path.join(PROFILE_DIR, '%s.pstats' % name))
+    with open(os.path.join(PROFILE_DIR, '%s.json' % name), 'w') as f:
+        json.dump({'name': name, 'callback': callback, 'duration': duration,
+                   'captured': time.strftime('%Y-%m-%d %H:%M:%S'),
+                   'trace_id': trace_id}, f)
+    remove_old_profiles()
+
+
+def remove_old_profiles():
+    names = sorted(file.rsplit('.', 1)[0] for file in os.listdir(PROFILE_DIR)
+                   if file.endswith('.json'))
+    for name in names[:max(len(names) - PROFILE_RETENTION, 0)]:
+        for ext in ['json', 'pstats']:
+            try:
+                os.remove(os.path.join(PROFILE_DIR, '%s.%s' % (name, ext)))
+            except OSError:
+                pass
+
+
+def get_captures():
+    captures = []
+    if not os.path.isdir(PROFILE_DIR):
+        return captures
+    for file in os.listdir(PROFILE_DIR):
+        if file.endswith('.json'):
+            try:
+                with open(os.path.join(PROFILE_DIR, file)) as f:
+                    captures.append(json.load(f))
+            except (OSError, ValueError):
+                pass
+    return sorted(captures, key=lambda capture: -capture['duration'])
+
+
+def get_profile_path(name):
+    path = os.path.join(PROFILE_DIR, '%s.pstats' % os.path.basename(name))
+    if not os.path.exists(path):
+        flask.abort(404)
+    return path
+
+
+def list_profiles():
+    return flask.render_template_string(
+        PROFILES_PAGE, captures=get_captures()[:PROFILE_LISTING])
+
+
+def profile_summary(name):
+    output = io.StringIO()
+    stats = pstats.Stats(get_profile_path(name), stream=output)
+    stats.sort_stats('cumulative').print_stats(40)
+    return flask.Response(output.getvalue(), mimetype='text/plain')
+
+
+def profile_file(name):
+    return flask.send_file(get_profile_path(name), as_attachment=True)
+
+
+def init_profiling(server):
+    server.add_url_rule('/admin/profiles', 'list_profiles', list_profiles)
+    server.add_url_rule('/admin/profiles/<name>.txt', 'profile_summary',
+                        profile_summary)
+    server.add_url_rule('/admin/profiles/<name>.pstats', 'profile_file',
+                        profile_file)
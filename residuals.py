@@ -0,0 +1,122 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from constants import (DEFAULT_PARAMS, VS30_COLUMNS, MIXED_EFFECTS_ITERATIONS,
+                       MIXED_EFFECTS_TOLERANCE)
+from cache import (get_file_signature, get_project_cache_dir, read_table,
+                   get_cached_frame, get_params_hash)
+from utils import evaluate_records, EVALUATION_COLUMNS
+
+# The GSIMs are evaluated on these columns, so they must include everything
+# utils._evaluate_model reads (e.g. the event depth)
+RESIDUAL_COLUMNS = ['StationID'] + EVALUATION_COLUMNS
+
+
+def get_vs30_column(df):
+    for col in VS30_COLUMNS:
+        if col in df.columns:
+            return col
+
+
+def get_residuals(wdir, proj, label, imc, imt, mod, progress=None):
+    # Residuals of every record of the project are computed once per
+    # metrics file version, IMT and model, and stored as a columnar table
+    # in the project cache.
+    cache_dir = get_project_cache_dir(wdir)
+    metrics_file = os.path.join(
+        wdir, '%s_%s_metrics_%s.csv' % (proj, label, imc))
+    residuals_dir = os.path.join(cache_dir, 'residuals')
+    os.makedirs(residuals_dir, exist_ok=True)
+    name = 'residuals-%s' % get_params_hash(imc, imt, mod, DEFAULT_PARAMS)
+    return get_cached_frame(
+        residuals_dir, name, get_file_signature(metrics_file),
+        lambda: compute_residuals(read_table(metrics_file, cache_dir), imt,
+                                  mod, progress))
+
+
+def compute_residuals(df, imt, mod, progress=None):
+    vs30_col = get_vs30_column(df)
+    columns = RESIDUAL_COLUMNS + ([vs30_col] if vs30_col else [])
+    df = df.loc[df[imt] > 0, columns + [imt]].reset_index(drop=True)
+
+    # One GSIM call per event: the rupture context is shared by all of the
+    # event's records and the sites and distances are vectorized. Station
+    # vs30 values are used when the metrics provide them.
+    mean = np.full(df.shape[0], np.nan)
+    groups = df.groupby('EarthquakeId').indices
+    for count, rows in enumerate(groups.values()):
+        if progress is not None and count % 50 == 0:
+            progress(0.9 * count / len(groups), 'Evaluating %s' % mod)
+        site_params = dict(DEFAULT_PARAMS['site'])
+        if vs30_col:
+            site_params['vs30'] = df[vs30_col].values[rows]
+        result = evaluate_records(site_params, DEFAULT_PARAMS['rup'],
+                                  df.iloc[rows], mod, imt)
+        if result is not None:
+            mean[rows] = result[0]
+
+    df['Total residual'] = np.log(df[imt].values) - np.log(mean)
+    df = df[np.isfinite(df['Total residual'])].reset_index(drop=True)
+    if progress is not None:
+        progress(0.9, 'Decomposing residuals')
+
+    events = pd.factorize(df['EarthquakeId'])[0]
+    stations = pd.factorize(df['StationID'])[0]
+    bias, event_terms, site_terms = decompose_residuals(
+        df['Total residual'].values, events, stations)
+    df['Bias'] = bias
+    df['Between-event residual'] = event_terms[events]
+    df['Within-event residual'] = (
+        df['Total residual'] - bias - df['Between-event residual'])
+    df['Site term'] = site_terms[stations]
+    df['Single-station within-event residual'] = (
+        df['Within-event residual'] - df['Site term'])
+    return df
+
+
+def decompose_residuals(resid, events, stations,
+                        niter=MIXED_EFFECTS_ITERATIONS,
+                        tol=MIXED_EFFECTS_TOLERANCE):
+    # Crossed random effects for events and stations, fitted by alternating
+    # between the best linear unbiased predictors of each effect and moment
+    # estimates of the variance components:
+    #   resid = bias + event term + site term + single-station residual
+    # events and stations are integer codes of every record.
+    nevents = np.bincount(events)
+    nstations = np.bincount(stations)
+    event_terms = np.zeros(nevents.size)
+    site_terms = np.zeros(nstations.size)
+    bias = resid.mean()
+    tau2 = phi_s2s2 = phi_ss2 = max(resid.var() / 3, tol)
+
+    for _ in range(niter):
+        previous = np.concatenate([[bias], event_terms, site_terms])
+        event_terms = np.bincount(
+            events, resid - bias - site_terms[stations]) / (
+                nevents + phi_ss2 / tau2)
+        site_terms = np.bincount(
+            stations, resid - bias - event_terms[events]) / (
+                nstations + phi_ss2 / phi_s2s2)
+        within = resid - event_terms[events] - site_terms[stations]
+        bias = within.mean()
+        tau2 = max(event_terms.var(), tol)
+        phi_s2s2 = max(site_terms.var(), tol)
+        phi_ss2 = max((within - bias).var(), tol)
+        current = np.concatenate([[bias], event_terms, site_terms])
+        if np.abs(current - previous).max() < tol:
+            break
+    return bias, event_terms, site_terms
+
+
+def get_residual_components(df):
+    # Standard deviations of the components, with every event and station
+    # counted once
+    return {
+        'bias': df['Bias'].iloc[0] if not df.empty else np.nan,
+        'tau': df.drop_duplicates('EarthquakeId')[
+            'Between-event residual'].std(),
+        'phi': df['Within-event residual'].std(),
+        'phi_s2s': df.drop_duplicates('StationID')['Site term'].std(),
+        'phi_ss': df['Single-station within-event residual'].std()}
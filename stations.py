@@ -0,0 +1,74 @@
+import os
+from functools import lru_cache
+
+import pandas as pd
+
+from constants import PROJECT_CACHE_SIZE
+from cache import get_file_signature, get_project_cache_dir, read_table
+from utils import load_dfs, get_project_version
+from residuals import get_residuals
+
+
+def get_metrics_file(wdir, proj, label, imc):
+    return os.path.join(wdir, '%s_%s_metrics_%s.csv' % (proj, label, imc))
+
+
+def get_station_version(wdir, proj, label, imc):
+    return (get_project_version(wdir, proj, label),
+            get_file_signature(get_metrics_file(wdir, proj, label, imc)))
+
+
+def get_station_index(wdir, proj, label, imc):
+    return _get_station_index(
+        wdir, proj, label, imc, *get_station_version(wdir, proj, label, imc))
+
+
+@lru_cache(maxsize=PROJECT_CACHE_SIZE)
+def _get_station_index(wdir, proj, label, imc, version, signature):
+    # Built once per project version: the metrics and status tables are
+    # kept whole and every station maps to the positions of its rows, so a
+    # station lookup is a take of a few rows rather than a scan.
+    df_status, df_imc, df_eq, df_st, df_net, df_events = load_dfs(
+        wdir, proj, label)
+    df_metrics = read_table(get_metrics_file(wdir, proj, label, imc),
+                            get_project_cache_dir(wdir))
+
+    df_status = df_status[['EarthquakeId', 'StationID',
+                           'Failure reason']].merge(
+        df_events[['id', 'time', 'magnitude']], left_on='EarthquakeId',
+        right_on='id', how='left')
+    df_status['time'] = pd.to_datetime(df_status['time'])
+    df_status['Passed'] = df_status['Failure reason'].isnull()
+
+    return {'metrics': df_metrics,
+            'metrics_rows': df_metrics.groupby('StationID').indices,
+            'status': df_status,
+            'status_rows': df_status.groupby('StationID').indices}
+
+
+def get_station_records(wdir, proj, label, imc, stid):
+    # Metrics rows of the station's records, one per event
+    index = get_station_index(wdir, proj, label, imc)
+    rows = index['metrics_rows'].get(stid, [])
+    return index['metrics'].iloc[rows].reset_index(drop=True)
+
+
+def get_station_status(wdir, proj, label, imc, stid):
+    # Pass/fail status of every record of the station in time order, with
+    # the workspace each record is stored in
+    index = get_station_index(wdir, proj, label, imc)
+    rows = index['status_rows'].get(stid, [])
+    df = index['status'].iloc[rows].sort_values('time').reset_index(
+        drop=True)
+    df['Workspace'] = [os.path.join(wdir, eqid, 'workspace.h5')
+                       for eqid in df['EarthquakeId']]
+    return df
+
+
+def get_station_residuals(wdir, proj, label, imc, stid, imt, mod,
+                          progress=None):
+    # Rows of the project residual table that belong to the station, so
+    # the site term is the one of the database-wide decomposition rather
+    # than being evaluated again per station
+    df = get_residuals(wdir, proj, label, imc, imt, mod, progress)
+    return df[df['StationID'] == stid].reset_index(drop=True)
@@ -0,0 +1,68 @@
+import numpy as np
+
+from cache import LRUCache
+from constants import SORTED_VIEW_CACHE_SIZE
+
+SORTED_VIEWS = LRUCache(SORTED_VIEW_CACHE_SIZE)
+
+
+def get_sorted_values(df, column, key=None):
+    # Sorted views are cached per data version (key) and column, so changing
+    # the resolution or binning of a curve does not sort the data again.
+    return get_sorted_view(
+        key, ('values', column),
+        lambda: np.sort(df[column].dropna().values))
+
+
+def get_sorted_counts(df, column, key=None):
+    return get_sorted_view(
+        key, ('counts', column),
+        lambda: np.sort(df[column].value_counts().values))
+
+
+def get_sorted_view(key, view, build):
+    if key is None:
+        return build()
+    values = SORTED_VIEWS.get((key,) + view)
+    if values is None:
+        values = build()
+        SORTED_VIEWS.set((key,) + view, values)
+    return values
+
+
+def get_bin_edges(sorted_values, nbins, log=False, from_min=False):
+    # Linear edges start at 0 for the cumulative and exceedance curves and
+    # at the smallest value for histograms (from_min), which may be
+    # negative
+    if sorted_values.size == 0:
+        return np.zeros(0)
+    max_value = sorted_values[-1]
+    if log:
+        positive = sorted_values[sorted_values > 0]
+        if positive.size == 0:
+            return np.zeros(0)
+        return np.geomspace(positive[0], max_value, nbins)
+    min_value = sorted_values[0] if from_min else 0
+    return np.linspace(min_value, max_value, nbins)
+
+
+def get_cumulative_counts(sorted_values, edges):
+    # Number of values in (0, edge] for every edge
+    return (np.searchsorted(sorted_values, edges, side='right') -
+            np.searchsorted(sorted_values, 0, side='right'))
+
+
+def get_exceedance_counts(sorted_values, edges):
+    # Number of values strictly greater than every edge
+    return sorted_values.size - np.searchsorted(
+        sorted_values, edges, side='right')
+
+
+def get_histogram(sorted_values, nbins, log=False):
+    edges = get_bin_edges(sorted_values, nbins + 1, log, from_min=True)
+    if edges.size == 0:
+        return edges, edges
+    positions = np.searchsorted(sorted_values, edges, side='right')
+    # The first bin includes its lower edge
+    positions[0] = np.searchsorted(sorted_values, edges[0], side='left')
+    return edges, np.diff(positions)
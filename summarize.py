@@ -0,0 +1,21 @@
+import argparse
+
+from utils import build_status_summaries
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Precompute the per-event pass/fail station summaries '
+                    'of a gmprocess project.')
+    parser.add_argument('wdir', help='gmprocess working directory')
+    parser.add_argument('-n', '--workers', type=int, default=None,
+                        help='number of worker processes')
+    args = parser.parse_args()
+
+    failed = build_status_summaries(args.wdir, max_workers=args.workers)
+    for eqid in failed:
+        print('Could not summarize event %s' % eqid)
+
+
+if __name__ == '__main__':
+    main()
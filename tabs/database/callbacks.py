@@ -1,54 +1,151 @@
 import dash
 from dash.dependencies import Input, Output, State
 
-from app import app
-from utils import load_dfs
+from app import app, clientside_callback
+from figures import cache_figure
+from utils import (load_dfs, get_imc_files, get_project_version,
+                   get_options, get_model_options)
+from watcher import get_data_version
+from stations import get_metrics_file
+from cache import get_optional_signature
+from jobs import submit_job, get_job_status
 
 from plots import (get_db_map_figure, get_db_net_bar_figure,
-                   get_db_fail_bar_figure, get_db_scatter_figure)
-from constants import IMC_MAPPINGS
-from utils import get_imc_files
+                   get_db_fail_bar_figure, get_db_scatter_figure,
+                   get_map_view, build_resid_figures, label_figure)
+from constants import IMC_MAPPINGS, DEFAULT_NBINS, IMT_REGEX, DIST_REGEX
+
+PROJECT_INPUTS = [Input('wdir', 'value'),
+                  Input('proj', 'value'),
+                  Input('label', 'value')]
+# The data version changes when the watcher sees new project data, which
+# refreshes every database figure
+DATA_INPUTS = PROJECT_INPUTS + [Input('data_version', 'data')]
+
+
+# Each figure is cached, serialized, on the project data version and only
+# the controls it depends on, so changing one control rebuilds a single
+# figure.
+@cache_figure
+def build_eq_map(wdir, proj, label, version, eq_color, view):
+    df_eq = load_dfs(wdir, proj, label)[2]
+    return get_db_map_figure(
+        df_eq, 'latitude', 'longitude', 'id', eq_color, 'Earthquake Map',
+        view, cluster=True)
+
+
+@cache_figure
+def build_st_map(wdir, proj, label, version, st_color, view):
+    df_st = load_dfs(wdir, proj, label)[3]
+    return get_db_map_figure(
+        df_st, 'StationLatitude', 'StationLongitude', 'StationID',
+        st_color, 'Station Map', view, cluster=True)
+
+
+@cache_figure
+def build_net_bar(wdir, proj, label, version, net_bar_select):
+    df_net = load_dfs(wdir, proj, label)[4]
+    return get_db_net_bar_figure(df_net, net_bar_select)
+
+
+@cache_figure
+def build_fail_bar(wdir, proj, label, version):
+    df_status = load_dfs(wdir, proj, label)[0]
+    return get_db_fail_bar_figure(df_status)
+
+
+@cache_figure
+def build_eq_scatter(wdir, proj, label, version, x, y, c):
+    df_eq = load_dfs(wdir, proj, label)[2]
+    return get_db_scatter_figure(
+        df_eq, x, y, c, key=(wdir, proj, label, version, 'eq'))
+
+
+@cache_figure
+def build_rec_scatter(wdir, proj, label, version, x, y, c, nbins, log_bins):
+    df_imc = load_dfs(wdir, proj, label)[1]
+    return get_db_scatter_figure(
+        df_imc, x, y, c, nbins, log_bins,
+        key=(wdir, proj, label, version, 'rec'))
 
 
 @app.callback(
-    [Output('db_eq_map', 'figure'),
-     Output('db_sta_map', 'figure'),
-     Output('db_net_bar', 'figure'),
-     Output('db_failure_bar', 'figure'),
-     Output('db_eq_scatter', 'figure'),
-     Output('db_rec_scatter', 'figure'),
-     Output('event_id_select', 'options'),
+    Output('db_eq_map', 'figure'),
+    DATA_INPUTS + [Input('color_select_eq', 'value'),
+                   Input('db_eq_map', 'relayoutData')])
+def update_db_eq_map(wdir, proj, label, data_version, eq_color,
+                     relayout_data):
+    return build_eq_map(wdir, proj, label,
+                        get_project_version(wdir, proj, label), eq_color,
+                        get_map_view(relayout_data))
+
+
+@app.callback(
+    Output('db_sta_map', 'figure'),
+    DATA_INPUTS + [Input('color_select_st', 'value'),
+                   Input('db_sta_map', 'relayoutData')])
+def update_db_sta_map(wdir, proj, label, data_version, st_color,
+                      relayout_data):
+    return build_st_map(wdir, proj, label,
+                        get_project_version(wdir, proj, label), st_color,
+                        get_map_view(relayout_data))
+
+
+@app.callback(
+    Output('db_net_bar', 'figure'),
+    DATA_INPUTS + [Input('net_bar_select', 'value')])
+def update_db_net_bar(wdir, proj, label, data_version, net_bar_select):
+    return build_net_bar(wdir, proj, label,
+                         get_project_version(wdir, proj, label),
+                         net_bar_select)
+
+
+@app.callback(
+    Output('db_failure_bar', 'figure'),
+    DATA_INPUTS)
+def update_db_fail_bar(wdir, proj, label, data_version):
+    return build_fail_bar(wdir, proj, label,
+                          get_project_version(wdir, proj, label))
+
+
+@app.callback(
+    Output('db_eq_scatter', 'figure'),
+    DATA_INPUTS + [Input('db_eq_scatter_x', 'value'),
+                   Input('db_eq_scatter_y', 'value'),
+                   Input('db_eq_scatter_c', 'value')])
+def update_db_eq_scatter(wdir, proj, label, data_version, db_eq_scatter_x,
+                         db_eq_scatter_y, db_eq_scatter_c):
+    return build_eq_scatter(wdir, proj, label,
+                            get_project_version(wdir, proj, label),
+                            db_eq_scatter_x, db_eq_scatter_y,
+                            db_eq_scatter_c)
+
+
+@app.callback(
+    Output('db_rec_scatter', 'figure'),
+    DATA_INPUTS + [Input('db_rec_scatter_x', 'value'),
+                   Input('db_rec_scatter_y', 'value'),
+                   Input('db_rec_scatter_c', 'value'),
+                   Input('db_rec_scatter_nbins', 'value'),
+                   Input('db_rec_scatter_log', 'value')])
+def update_db_rec_scatter(wdir, proj, label, data_version, db_rec_scatter_x,
+                          db_rec_scatter_y, db_rec_scatter_c, nbins,
+                          log_bins):
+    return build_rec_scatter(wdir, proj, label,
+                             get_project_version(wdir, proj, label),
+                             db_rec_scatter_x, db_rec_scatter_y,
+                             db_rec_scatter_c, int(nbins or DEFAULT_NBINS),
+                             'log' in (log_bins or []))
+
+
+@app.callback(
+    [Output('event_id_select', 'options'),
      Output('station_id_select', 'options'),
      Output('imc_select', 'options')],
-    [Input('wdir', 'value'),
-     Input('proj', 'value'),
-     Input('label', 'value'),
-     Input('color_select_eq', 'value'),
-     Input('color_select_st', 'value'),
-     Input('net_bar_select', 'value'),
-     Input('db_eq_scatter_x', 'value'),
-     Input('db_eq_scatter_y', 'value'),
-     Input('db_eq_scatter_c', 'value'),
-     Input('db_rec_scatter_x', 'value'),
-     Input('db_rec_scatter_y', 'value'),
-     Input('db_rec_scatter_c', 'value')])
-def update_output(wdir, proj, label, eq_color, st_color, net_bar_select,
-                  db_eq_scatter_x, db_eq_scatter_y, db_eq_scatter_c,
-                  db_rec_scatter_x, db_rec_scatter_y, db_rec_scatter_c):
+    DATA_INPUTS)
+def update_db_options(wdir, proj, label, data_version):
     df_status, df_imc, df_eq, df_st, df_net, df_events = load_dfs(
         wdir, proj, label)
-    db_eq_fig = get_db_map_figure(
-        df_eq, 'latitude', 'longitude', 'id',
-        eq_color, 'Earthquake Map')
-    db_st_fig = get_db_map_figure(
-        df_st, 'StationLatitude', 'StationLongitude', 'StationID',
-        st_color, 'Station Map')
-    db_net_bar_fig = get_db_net_bar_figure(df_net, net_bar_select)
-    db_fail_bar_fig = get_db_fail_bar_figure(df_status)
-    db_eq_scatter = get_db_scatter_figure(
-        df_eq, db_eq_scatter_x, db_eq_scatter_y, db_eq_scatter_c)
-    db_rec_scatter = get_db_scatter_figure(
-        df_imc, db_rec_scatter_x, db_rec_scatter_y, db_rec_scatter_c)
     ev_id_options = [{'label': id, 'value': id} for id in df_events.id]
     st_id_options = [
         {'label': id, 'value': id} for id in df_imc['StationID'].unique()]
@@ -57,12 +154,110 @@ def update_output(wdir, proj, label, eq_color, st_color, net_bar_select,
                     'value': imc.split('.csv')[0].split('_')[-1]}
                    for imc in get_imc_files(wdir)]
 
-    return (db_eq_fig, db_st_fig, db_net_bar_fig, db_fail_bar_fig,
-            db_eq_scatter, db_rec_scatter, ev_id_options, st_id_options,
-            imc_options)
+    return ev_id_options, st_id_options, imc_options
+
+
+@app.callback(
+    [Output('db_resid_imc', 'options'),
+     Output('db_resid_imc', 'value'),
+     Output('db_resid_imt', 'options'),
+     Output('db_resid_imt', 'value'),
+     Output('db_resid_dist', 'options'),
+     Output('db_resid_dist', 'value')],
+    DATA_INPUTS)
+def update_db_resid_options(wdir, proj, label, data_version):
+    df_imc = load_dfs(wdir, proj, label)[1]
+    imcs = [imc.split('.csv')[0].split('_')[-1]
+            for imc in get_imc_files(wdir)]
+    imc_options = [{'label': IMC_MAPPINGS[imc], 'value': imc}
+                   for imc in imcs]
+    imt_options = get_options(df_imc, IMT_REGEX)
+    dist_options = get_options(df_imc, DIST_REGEX)
+    return (imc_options, imcs[0] if imcs else None, imt_options,
+            imt_options[0]['value'] if imt_options else None, dist_options,
+            dist_options[0]['value'] if dist_options else None)
+
+
+@app.callback(
+    Output('db_resid_mod', 'options'),
+    [Input('db_resid_imc', 'value'),
+     Input('db_resid_imt', 'value')])
+def update_db_resid_models(imc, imt):
+    if imc is None or imt is None:
+        return []
+    return get_model_options(imc, imt)
+
+
+@app.callback(
+    Output('db_resid_job', 'data'),
+    DATA_INPUTS + [Input('db_resid_imc', 'value'),
+                   Input('db_resid_imt', 'value'),
+                   Input('db_resid_dist', 'value'),
+                   Input('db_resid_mod', 'value')],
+    [State('session_id', 'data')])
+def update_db_resid(wdir, proj, label, data_version, imc, imt, dist, mod,
+                    session_id):
+    if any([val is None for val in [imc, imt, dist, mod]]):
+        return None
+    # The data version is None when the watcher is disabled, so the key
+    # carries the metrics file version itself
+    args = (wdir, proj, label, imc, imt, dist, mod)
+    version = get_optional_signature(get_metrics_file(wdir, proj, label, imc))
+    return submit_job(('resid_figures', repr(version)) + args,
+                      ('resid_figures', session_id), build_resid_figures,
+                      *args)
 
 
 @app.callback(
+    [Output('db_resid_mag_data', 'data'),
+     Output('db_resid_dist_data', 'data'),
+     Output('db_resid_site_data', 'data'),
+     Output('db_resid_labels', 'data'),
+     Output('db_resid_job_progress', 'children'),
+     Output('db_resid_job_poll', 'disabled')],
+    [Input('db_resid_job', 'data'),
+     Input('db_resid_job_poll', 'n_intervals')])
+def poll_db_resid(job_id, n_intervals):
+    if job_id is None:
+        return [{'data': None, 'layout': None}] * 3 + [None, '', True]
+    status, fraction, message, result = get_job_status(job_id)
+    if status == 'running':
+        return [dash.no_update] * 4 + [
+            '%d%% %s' % (100 * fraction, message), False]
+    elif status == 'done':
+        return list(result) + ['', True]
+    elif status == 'failed':
+        return [dash.no_update] * 4 + ['Failed: %s' % message, True]
+    else:
+        return [dash.no_update] * 4 + ['', True]
+
+
+@clientside_callback(
+    [Output('db_resid_mag', 'figure'),
+     Output('db_resid_dist_fig', 'figure'),
+     Output('db_resid_site', 'figure')],
+    [Input('db_resid_mag_data', 'data'),
+     Input('db_resid_dist_data', 'data'),
+     Input('db_resid_site_data', 'data'),
+     Input('db_resid_labels', 'data')]
+)
+def label_figures(mag_fig, dist_fig, site_fig, labels):
+    return [label_figure(fig, labels)
+            for fig in [mag_fig, dist_fig, site_fig]]
+
+
+@app.callback(
+    Output('data_version', 'data'),
+    PROJECT_INPUTS + [Input('data_poll', 'n_intervals')],
+    [State('data_version', 'data')])
+def update_data_version(wdir, proj, label, n_intervals, current_version):
+    version = get_data_version(wdir, proj, label)
+    if version == current_version:
+        return dash.no_update
+    return version
+
+
+@clientside_callback(
     [Output('tabs', 'value'),
      Output('event_id_select', 'value'),
      Output('station_id_select', 'value')],
@@ -73,19 +268,23 @@ def update_output(wdir, proj, label, eq_color, st_color, net_bar_select,
      Input('ev_resid', 'clickData')],
     [State('tabs', 'value'),
      State('event_id_select', 'value'),
-     State('station_id_select', 'value')]
+     State('station_id_select', 'value'),
+     State('ev_station_labels', 'data')]
 )
 def handle_db_eq_click(db_eq_click, db_st_click, eq_map_click,
                        eq_moveout_click, eq_resid_click, current_tab,
-                       current_event, current_station):
+                       current_event, current_station, station_labels):
 
     ctx = dash.callback_context
     clickid = ctx.triggered[0]['prop_id'].split('.')[0]
 
-    if db_eq_click and clickid == 'db_eq_map':
+    # Clicks on map clusters carry an empty id and are ignored
+    if db_eq_click and clickid == 'db_eq_map' and (
+            db_eq_click['points'][0]['customdata'][0]):
         return ('Event', db_eq_click['points'][0]['customdata'][0],
                 current_station)
-    elif db_st_click and clickid == 'db_sta_map':
+    elif db_st_click and clickid == 'db_sta_map' and (
+            db_st_click['points'][0]['customdata'][0]):
         return ('Station', current_event,
                 db_st_click['points'][0]['customdata'][0])
     elif eq_map_click and clickid == 'ev_eq_map':
@@ -93,9 +292,17 @@ def handle_db_eq_click(db_eq_click, db_st_click, eq_map_click,
                 eq_map_click['points'][0]['customdata'][0])
     elif eq_moveout_click and clickid == 'ev_moveout':
         return ('Record', current_event,
-                eq_moveout_click['points'][0]['hovertext'])
+                get_clicked_station(eq_moveout_click, station_labels))
     elif eq_resid_click and clickid == 'ev_resid':
         return ('Record', current_event,
-                eq_resid_click['points'][0]['hovertext'])
+                get_clicked_station(eq_resid_click, station_labels))
     else:
         return current_tab, current_event, current_station
+
+
+def get_clicked_station(click_data, station_labels):
+    # WebGL figures carry positions in the station labels instead of ids
+    point = click_data['points'][0]
+    if 'hovertext' in point:
+        return point['hovertext']
+    return station_labels['stations'][point['customdata']]
@@ -1,6 +1,7 @@
 import dash_ui as dui
 import dash_core_components as dcc
 import dash_html_components as html
+from constants import DEFAULT_NBINS, JOB_POLL_INTERVAL
 
 
 def get_control_panel(wdir, proj, label):
@@ -14,6 +15,7 @@ def get_control_panel(wdir, proj, label):
         group='eq_scatter', group_title='Earthquake Scatter Plot options')
     db_cp.create_group(
         group='rec_scatter', group_title='Record Scatter Plot options')
+    db_cp.create_group(group='resid', group_title='Residual options')
 
     db_cp.add_element(
         html.Div([dcc.Input(id='wdir', value=wdir)]), 'wdir')
@@ -123,11 +125,38 @@ def get_control_panel(wdir, proj, label):
         ]],
         placeholder='color'), 'rec_scatter')
 
+    db_cp.add_element(html.Div([
+        html.P('Number of bins'),
+        dcc.Input(id='db_rec_scatter_nbins', value=DEFAULT_NBINS,
+                  type='number', min=2),
+        dcc.Checklist(
+            id='db_rec_scatter_log',
+            options=[{'label': 'Log bins', 'value': 'log'}],
+            value=[])]), 'rec_scatter')
+
+    db_cp.add_element(dcc.Dropdown(
+        id='db_resid_imc', options=[], placeholder='IMC'), 'resid')
+    db_cp.add_element(dcc.Dropdown(
+        id='db_resid_imt', options=[], placeholder='IMT'), 'resid')
+    db_cp.add_element(dcc.Dropdown(
+        id='db_resid_dist', options=[], placeholder='Distance'), 'resid')
+    db_cp.add_element(dcc.Dropdown(
+        id='db_resid_mod', options=[], placeholder='Model'), 'resid')
+    db_cp.add_element(html.Div([
+        html.Div(id='db_resid_job_progress'),
+        dcc.Store(id='db_resid_job'),
+        dcc.Store(id='db_resid_mag_data'),
+        dcc.Store(id='db_resid_dist_data'),
+        dcc.Store(id='db_resid_site_data'),
+        dcc.Store(id='db_resid_labels'),
+        dcc.Interval(id='db_resid_job_poll', interval=JOB_POLL_INTERVAL,
+                     disabled=True)]), 'resid')
+
     return db_cp
 
 
 def get_grid():
-    db_grid = dui.Grid(_id='db_grid', num_rows=2, num_cols=3)
+    db_grid = dui.Grid(_id='db_grid', num_rows=3, num_cols=3)
     db_grid.add_graph(col=1, row=1, width=1, height=1, graph_id='db_eq_map')
     db_grid.add_graph(col=1, row=2, width=1, height=1, graph_id='db_sta_map')
     db_grid.add_graph(col=2, row=1, width=1, height=1,
@@ -137,4 +166,10 @@ def get_grid():
                       graph_id='db_eq_scatter')
     db_grid.add_graph(col=3, row=2, width=1, height=1,
                       graph_id='db_rec_scatter')
+    db_grid.add_graph(col=1, row=3, width=1, height=1,
+                      graph_id='db_resid_mag')
+    db_grid.add_graph(col=2, row=3, width=1, height=1,
+                      graph_id='db_resid_dist_fig')
+    db_grid.add_graph(col=3, row=3, width=1, height=1,
+                      graph_id='db_resid_site')
     return db_grid
@@ -1,15 +1,21 @@
-from dash.dependencies import Input, Output
+from functools import lru_cache
 
-from app import app
+import dash
+import dash_html_components as html
+from dash.dependencies import Input, Output, State
 
-from utils import (
-    get_eq_imc_df, get_options, get_model_options, get_eq_full_status_df)
-from plots import get_db_map_figure, get_eq_moveout_resid_figs
+from app import app, clientside_callback
 
-from gmprocess.utils.event import get_event_object
+from utils import (get_eq_imc_df, get_options, get_model_options,
+                   get_event_version, get_current_value)
+from plots import build_eq_figures, label_figure
+from jobs import submit_job, get_job_status
+from prefetch import prefetch_records, rank_stations
+from events import get_event_info
 
 from constants import (
-    IMT_REGEX, DIST_REGEX, MODELS_DICT, ALL_PARAMS, DEFAULT_PARAMS)
+    IMT_REGEX, DIST_REGEX, ALL_PARAMS, DEFAULT_PARAMS)
+from gsims import get_required_params
 
 
 @app.callback(
@@ -18,49 +24,72 @@ from constants import (
      Output('dist_select', 'options'),
      Output('dist_select', 'value'),
      Output('mod_select', 'options'),
+     Output('mod_compare_select', 'options'),
      Output('eq_info', 'children')],
     [Input('wdir', 'value'),
      Input('proj', 'value'),
      Input('label', 'value'),
      Input('imc_select', 'value'),
-     Input('event_id_select', 'value')]
+     Input('event_id_select', 'value'),
+     Input('data_version', 'data')],
+    [State('imt_select', 'value'),
+     State('dist_select', 'value'),
+     State('session_id', 'data')]
 )
-def update_eq_options(wdir, proj, label, imc, eqid):
-    if any([val is None for val in locals().values()]):
-        return [], None, [], None, [], []
+def update_eq_options(wdir, proj, label, imc, eqid, data_version,
+                      current_imt, current_dist, session_id):
+    if any([val is None for val in [wdir, proj, label, imc, eqid]]):
+        return [], None, [], None, [], [], []
     df_eq_imc = get_eq_imc_df(wdir, proj, label, eqid, imc)
     imt_options = get_options(df_eq_imc, IMT_REGEX)
     imt_options.append({'label': 'Pass/Fail', 'value': 'Pass/Fail'})
     imt = imt_options[0]['value']
     dist_options = get_options(df_eq_imc, DIST_REGEX)
     dist = dist_options[0]['value']
-    model_options = get_model_options(MODELS_DICT, imc, imt)
-    rep = get_event_object(eqid).__repr__()
-    return imt_options, imt, dist_options, dist, model_options, rep
+    # The model options depend on the event's first IMT, as when the event
+    # is selected, so keeping Pass/Fail below does not empty them
+    model_options = get_model_options(imc, imt)
+    clickid = dash.callback_context.triggered[0]['prop_id'].split('.')[0]
+    if clickid == 'data_version':
+        # New project data keeps the current selection where it still exists
+        imt = get_current_value(imt_options, current_imt, imt)
+        dist = get_current_value(dist_options, current_dist, dist)
+    prefetch_records(wdir, eqid, rank_stations(df_eq_imc, imt), session_id)
+    rep = get_event_info(wdir, proj, label, eqid)
+    return (imt_options, imt, dist_options, dist, model_options,
+            model_options, rep)
 
 
 @app.callback(
     [Output(param, 'style') for param in ALL_PARAMS] + [
         Output('%s_p' % param, 'style') for param in ALL_PARAMS],
-    [Input('mod_select', 'value')]
+    [Input('mod_select', 'value'),
+     Input('mod_compare_select', 'value')]
 )
-def update_model_params(mod):
-    if mod:
-        mod = MODELS_DICT[mod]
-        styles = [{'display': 'block'} if (
-            param in mod.REQUIRES_SITES_PARAMETERS or
-            param in mod.REQUIRES_RUPTURE_PARAMETERS) else
-            {'display': 'none'} for param in ALL_PARAMS]
+def update_model_params(mod, compare_mods):
+    return get_param_styles(tuple(get_selected_models(mod, compare_mods)))
+
+
+def get_selected_models(mod, compare_mods):
+    mods = [mod] if mod else []
+    return mods + [mod_str for mod_str in compare_mods or []
+                   if mod_str not in mods]
+
+
+@lru_cache(maxsize=None)
+def get_param_styles(mods):
+    if mods:
+        required = frozenset().union(
+            *[get_required_params(mod) for mod in mods])
+        styles = [{'display': 'block'} if param in required else
+                  {'display': 'none'} for param in ALL_PARAMS]
         return styles * 2
     else:
         return [{'display': 'none'} for param in ALL_PARAMS] * 2
 
 
 @app.callback(
-    [Output('ev_eq_map', 'figure'),
-     Output('ev_moveout', 'figure'),
-     Output('ev_resid', 'figure'),
-     Output('ev_hist', 'figure')],
+    Output('ev_job', 'data'),
     [Input('wdir', 'value'),
      Input('proj', 'value'),
      Input('label', 'value'),
@@ -68,19 +97,17 @@ def update_model_params(mod):
      Input('imt_select', 'value'),
      Input('event_id_select', 'value'),
      Input('dist_select', 'value'),
-     Input('mod_select', 'value')] + [
-         Input(param, 'value') for param in ALL_PARAMS])
-def update_eq_figures(wdir, proj, label, imc, imt, eqid, dist, mod, backarc, lat, lon,
+     Input('mod_select', 'value'),
+     Input('mod_compare_select', 'value'),
+     Input('data_version', 'data')] + [
+         Input(param, 'value') for param in ALL_PARAMS],
+    [State('session_id', 'data')])
+def update_eq_figures(wdir, proj, label, imc, imt, eqid, dist, mod,
+                      compare_mods, data_version, backarc, lat, lon,
                       siteclass, vs30, vs30measured, xvf, z1pt0, z2pt5, dip,
-                      rake, width, ztor):
-    if imt == 'Pass/Fail':
-        df = get_eq_full_status_df(wdir, eqid, imc)
-    else:
-        df = get_eq_imc_df(wdir, proj, label, eqid, imc)
-
-    eq_map_fig = get_db_map_figure(
-        df, 'StationLatitude', 'StationLongitude', 'StationID', imt, '')
-
+                      rake, width, ztor, session_id):
+    if any([val is None for val in [wdir, proj, label, imc, imt, eqid]]):
+        return None
     site_params = {}
     rup_params = {}
 
@@ -89,7 +116,70 @@ def update_eq_figures(wdir, proj, label, imc, imt, eqid, dist, mod, backarc, lat
     for param in DEFAULT_PARAMS['rup'].keys():
         rup_params[param] = locals()[param]
 
-    eq_moveout_fig, eq_resid_fig, eq_hist = get_eq_moveout_resid_figs(
-        df, dist, imt, mod, site_params, rup_params)
+    mods = get_selected_models(mod, compare_mods)
+    args = (wdir, proj, label, imc, imt, eqid, dist, mods, site_params,
+            rup_params)
+    # The key carries the versions of the event's files, so that new data
+    # is not answered with a finished job built from the old data
+    version = get_event_version(wdir, proj, label, eqid, imc)
+    return submit_job(('eq_figures', repr(args), repr(version)),
+                      ('eq_figures', session_id), build_eq_figures, *args)
+
 
-    return (eq_map_fig, eq_moveout_fig, eq_resid_fig, eq_hist)
+@app.callback(
+    [Output('ev_eq_map', 'figure'),
+     Output('ev_moveout_data', 'data'),
+     Output('ev_resid_data', 'data'),
+     Output('ev_hist', 'figure'),
+     Output('ev_model_table', 'children'),
+     Output('ev_station_labels', 'data'),
+     Output('ev_job_progress', 'children'),
+     Output('ev_job_poll', 'disabled')],
+    [Input('ev_job', 'data'),
+     Input('ev_job_poll', 'n_intervals')]
+)
+def poll_eq_figures(job_id, n_intervals):
+    if job_id is None:
+        return [{'data': None, 'layout': None}] * 4 + [[], None, '', True]
+    status, fraction, message, result = get_job_status(job_id)
+    if status == 'running':
+        return [dash.no_update] * 6 + [
+            '%d%% %s' % (100 * fraction, message), False]
+    elif status == 'done':
+        eq_map_fig, eq_moveout_fig, eq_resid_fig, eq_hist, stats, labels = (
+            result)
+        return (eq_map_fig, eq_moveout_fig, eq_resid_fig, eq_hist,
+                get_model_table(stats), labels, '', True)
+    elif status == 'failed':
+        return [dash.no_update] * 6 + ['Failed: %s' % message, True]
+    else:
+        return [dash.no_update] * 6 + ['', True]
+
+
+def get_model_table(stats):
+    if not stats:
+        return []
+    header = html.Tr([html.Th(col) for col in
+                      ['Model', 'Mean', 'Std. dev.', 'LLH']])
+    rows = []
+    for mod, mod_stats in stats.items():
+        if mod_stats is None:
+            cells = [mod, 'Failed or timed out', '', '']
+        else:
+            # NaN statistics come back from the figure cache as None
+            cells = [mod] + [
+                'n/a' if mod_stats[stat] is None else '%.3f' % mod_stats[stat]
+                for stat in ['mean', 'std', 'llh']]
+        rows.append(html.Tr([html.Td(cell) for cell in cells]))
+    return html.Table([header] + rows)
+
+
+@clientside_callback(
+    [Output('ev_moveout', 'figure'),
+     Output('ev_resid', 'figure')],
+    [Input('ev_moveout_data', 'data'),
+     Input('ev_resid_data', 'data'),
+     Input('ev_station_labels', 'data')]
+)
+def label_figures(moveout_fig, resid_fig, labels):
+    return label_figure(moveout_fig, labels), label_figure(resid_fig, labels)
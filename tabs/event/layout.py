@@ -1,7 +1,7 @@
 import dash_ui as dui
 import dash_core_components as dcc
 import dash_html_components as html
-from constants import DEFAULT_PARAMS
+from constants import DEFAULT_PARAMS, JOB_POLL_INTERVAL
 
 
 def get_control_panel(wdir, proj, label):
@@ -17,11 +17,22 @@ def get_control_panel(wdir, proj, label):
 
     eq_cp.add_element(dcc.Dropdown(id='event_id_select', options=[
         {'label': option, 'value': option} for option in []]), 'event_select')
+    eq_cp.add_element(dcc.Store(id='ev_station_labels'), 'event_select')
+    eq_cp.add_element(dcc.Store(id='ev_moveout_data'), 'event_select')
+    eq_cp.add_element(dcc.Store(id='ev_resid_data'), 'event_select')
+    eq_cp.add_element(html.Div([
+        html.Div(id='ev_job_progress'),
+        dcc.Store(id='ev_job'),
+        dcc.Interval(id='ev_job_poll', interval=JOB_POLL_INTERVAL,
+                     disabled=True)]), 'event_select')
     eq_cp.add_element(dcc.Dropdown(id='imc_select', options=[]), 'imc_select')
     eq_cp.add_element(dcc.Dropdown(id='imt_select', options=[]), 'imt_select')
     eq_cp.add_element(dcc.Dropdown(
         id='dist_select', options=[]), 'dist_select')
     eq_cp.add_element(dcc.Dropdown(id='mod_select', options=[]), 'mod_select')
+    eq_cp.add_element(dcc.Dropdown(
+        id='mod_compare_select', options=[], multi=True,
+        placeholder='Compare models'), 'mod_select')
 
     for param_type in DEFAULT_PARAMS.keys():
         for param in DEFAULT_PARAMS[param_type]:
@@ -56,4 +67,6 @@ def get_grid():
     eq_grid.add_graph(col=1, row=7, width=1, height=5, graph_id='ev_hist')
     eq_grid.add_graph(col=2, row=2, width=1, height=5, graph_id='ev_moveout')
     eq_grid.add_graph(col=2, row=7, width=1, height=5, graph_id='ev_resid')
+    eq_grid.add_element(col=3, row=2, width=1, height=5, element=html.Div(
+        id='ev_model_table'))
     return eq_grid
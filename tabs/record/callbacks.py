@@ -1,10 +1,15 @@
-from dash.dependencies import Input, Output
+import os
 
-from app import app
-from plots import get_rec_plot
+import dash
+from dash.dependencies import Input, Output, State
 
+from app import app, clientside_callback
+from jobs import submit_job, get_job_status
+from plots import build_rec_plot, get_rec_plot_job_key
+from cache import get_optional_signature
 
-@app.callback(
+
+@clientside_callback(
     [Output('rec_eq_select', 'value'),
      Output('rec_eq_select', 'options'),
      Output('rec_st_select', 'value'),
@@ -19,12 +24,53 @@ def update_rec_dropdowns(eqid, eq_options, stid, st_options):
 
 
 @app.callback(
-    Output('rec_plot', 'figure'),
+    [Output('rec_job', 'data'),
+     Output('rec_version', 'data')],
     [Input('rec_eq_select', 'value'),
      Input('rec_st_select', 'value'),
-     Input('wdir', 'value')]
+     Input('wdir', 'value'),
+     Input('rec_plot', 'relayoutData'),
+     Input('data_version', 'data')],
+    [State('session_id', 'data'),
+     State('rec_version', 'data')]
 )
-def update_rec_plot(eqid, stid, wdir):
+def update_rec_plot(eqid, stid, wdir, relayout_data, data_version,
+                    session_id, shown_version):
     if eqid is None or stid is None:
-        return {}
-    return get_rec_plot(eqid, stid, wdir)
+        return None, None
+    version = get_optional_signature(
+        os.path.join(wdir, eqid, 'workspace.h5'))
+    clickid = dash.callback_context.triggered[0]['prop_id'].split('.')[0]
+    if clickid == 'data_version' and version == shown_version:
+        # New project data only redraws the record if its workspace changed
+        return dash.no_update, dash.no_update
+    if clickid != 'rec_plot':
+        # A new record starts fully zoomed out
+        relayout_data = None
+    elif not relayout_data:
+        return dash.no_update, dash.no_update
+    return submit_job(
+        get_rec_plot_job_key(eqid, stid, wdir, version, relayout_data),
+        ('rec_plot', session_id), build_rec_plot, eqid, stid, wdir,
+        relayout_data), version
+
+
+@app.callback(
+    [Output('rec_plot', 'figure'),
+     Output('rec_job_progress', 'children'),
+     Output('rec_job_poll', 'disabled')],
+    [Input('rec_job', 'data'),
+     Input('rec_job_poll', 'n_intervals')]
+)
+def poll_rec_plot(job_id, n_intervals):
+    if job_id is None:
+        return {}, '', True
+    status, fraction, message, fig = get_job_status(job_id)
+    if status == 'running':
+        return dash.no_update, '%d%% %s' % (100 * fraction, message), False
+    elif status == 'done':
+        return fig if fig is not None else dash.no_update, '', True
+    elif status == 'failed':
+        return dash.no_update, 'Failed: %s' % message, True
+    else:
+        return dash.no_update, '', True
@@ -1,5 +1,7 @@
 import dash_ui as dui
 import dash_core_components as dcc
+import dash_html_components as html
+from constants import JOB_POLL_INTERVAL
 
 
 def get_control_panel(wdir, proj, label):
@@ -12,6 +14,13 @@ def get_control_panel(wdir, proj, label):
                        'rec_eq_select')
     rec_cp.add_element(dcc.Dropdown(id='rec_st_select', options=[]),
                        'rec_st_select')
+    rec_cp.create_group(group='rec_status', group_title='Status')
+    rec_cp.add_element(html.Div([
+        html.Div(id='rec_job_progress'),
+        dcc.Store(id='rec_job'),
+        dcc.Store(id='rec_version'),
+        dcc.Interval(id='rec_job_poll', interval=JOB_POLL_INTERVAL,
+                     disabled=True)]), 'rec_status')
     return rec_cp
 
 
@@ -0,0 +1,114 @@
+import dash
+from dash.dependencies import Input, Output, State
+
+from app import app
+
+from utils import (get_imc_files, get_options, get_model_options,
+                   get_current_value)
+from stations import get_station_records, get_station_version
+from plots import build_st_figures
+from jobs import submit_job, get_job_status
+from constants import IMC_MAPPINGS, IMT_REGEX, DIST_REGEX
+
+
+@app.callback(
+    [Output('st_imc_select', 'options'),
+     Output('st_imc_select', 'value')],
+    [Input('wdir', 'value')]
+)
+def update_st_imc_options(wdir):
+    imcs = [imc.split('.csv')[0].split('_')[-1]
+            for imc in get_imc_files(wdir)]
+    options = [{'label': IMC_MAPPINGS[imc], 'value': imc} for imc in imcs]
+    return options, imcs[0] if imcs else None
+
+
+@app.callback(
+    [Output('st_imt_select', 'options'),
+     Output('st_imt_select', 'value'),
+     Output('st_dist_select', 'options'),
+     Output('st_dist_select', 'value')],
+    [Input('wdir', 'value'),
+     Input('proj', 'value'),
+     Input('label', 'value'),
+     Input('st_imc_select', 'value'),
+     Input('station_id_select', 'value'),
+     Input('data_version', 'data')],
+    [State('st_imt_select', 'value'),
+     State('st_dist_select', 'value')]
+)
+def update_st_options(wdir, proj, label, imc, stid, data_version,
+                      current_imt, current_dist):
+    if any([val is None for val in [wdir, proj, label, imc, stid]]):
+        return [], None, [], None
+    df = get_station_records(wdir, proj, label, imc, stid)
+    imt_options = get_options(df, IMT_REGEX)
+    dist_options = get_options(df, DIST_REGEX)
+    imt = imt_options[0]['value'] if imt_options else None
+    dist = dist_options[0]['value'] if dist_options else None
+    clickid = dash.callback_context.triggered[0]['prop_id'].split('.')[0]
+    if clickid == 'data_version':
+        # New project data keeps the current selection where it still exists
+        imt = get_current_value(imt_options, current_imt, imt)
+        dist = get_current_value(dist_options, current_dist, dist)
+    return imt_options, imt, dist_options, dist
+
+
+@app.callback(
+    Output('st_mod_select', 'options'),
+    [Input('st_imc_select', 'value'),
+     Input('st_imt_select', 'value')]
+)
+def update_st_model_options(imc, imt):
+    if imc is None or imt is None:
+        return []
+    return get_model_options(imc, imt)
+
+
+@app.callback(
+    Output('st_job', 'data'),
+    [Input('wdir', 'value'),
+     Input('proj', 'value'),
+     Input('label', 'value'),
+     Input('st_imc_select', 'value'),
+     Input('station_id_select', 'value'),
+     Input('st_imt_select', 'value'),
+     Input('st_dist_select', 'value'),
+     Input('st_mod_select', 'value'),
+     Input('data_version', 'data')],
+    [State('session_id', 'data')]
+)
+def update_st_figures(wdir, proj, label, imc, stid, imt, dist, mod,
+                      data_version, session_id):
+    if any([val is None for val in [wdir, proj, label, imc, stid]]):
+        return None
+    # The site term needs the residuals of the whole project, so the
+    # figures are built in the background
+    args = (wdir, proj, label, imc, stid, imt, dist, mod)
+    version = get_station_version(wdir, proj, label, imc)
+    return submit_job(('st_figures', repr(version)) + args,
+                      ('st_figures', session_id), build_st_figures, *args)
+
+
+@app.callback(
+    [Output('st_amp_dist', 'figure'),
+     Output('st_amp_mag', 'figure'),
+     Output('st_pass_rate', 'figure'),
+     Output('st_site_term', 'figure'),
+     Output('st_job_progress', 'children'),
+     Output('st_job_poll', 'disabled')],
+    [Input('st_job', 'data'),
+     Input('st_job_poll', 'n_intervals')])
+def poll_st_figures(job_id, n_intervals):
+    if job_id is None:
+        return [{'data': None, 'layout': None}] * 4 + ['', True]
+    status, fraction, message, figs = get_job_status(job_id)
+    if status == 'running':
+        return [dash.no_update] * 4 + [
+            '%d%% %s' % (100 * fraction, message), False]
+    elif status == 'done':
+        return list(figs) + ['', True]
+    elif status == 'failed':
+        return [dash.no_update] * 4 + ['Failed: %s' % message, True]
+    else:
+        return [dash.no_update] * 4 + ['', True]
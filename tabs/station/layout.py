@@ -1,12 +1,33 @@
 import dash_ui as dui
 import dash_core_components as dcc
+import dash_html_components as html
+from constants import JOB_POLL_INTERVAL
 
 
 def get_control_panel(wdir, proj, label):
     st_cp = dui.ControlPanel(_id='st_controlpanel')
     st_cp.create_group(group='st_select', group_title='Station ID selection')
+    st_cp.create_group(group='st_imc_select', group_title='IMC selection')
+    st_cp.create_group(group='st_imt_select', group_title='IMT selection')
+    st_cp.create_group(group='st_dist_select',
+                       group_title='Distance selection')
+    st_cp.create_group(group='st_mod_select', group_title='Model selection')
     st_cp.add_element(dcc.Dropdown(id='station_id_select', options=[
         {'label': option, 'value': option} for option in []]), 'st_select')
+    st_cp.add_element(dcc.Dropdown(id='st_imc_select', options=[]),
+                      'st_imc_select')
+    st_cp.add_element(dcc.Dropdown(id='st_imt_select', options=[]),
+                      'st_imt_select')
+    st_cp.add_element(dcc.Dropdown(id='st_dist_select', options=[]),
+                      'st_dist_select')
+    st_cp.add_element(dcc.Dropdown(id='st_mod_select', options=[]),
+                      'st_mod_select')
+    st_cp.create_group(group='st_status', group_title='Status')
+    st_cp.add_element(html.Div([
+        html.Div(id='st_job_progress'),
+        dcc.Store(id='st_job'),
+        dcc.Interval(id='st_job_poll', interval=JOB_POLL_INTERVAL,
+                     disabled=True)]), 'st_status')
     return st_cp
 
 
@@ -14,6 +35,14 @@ def get_grid():
     st_grid = dui.Grid(
         _id='st_grid',
         num_rows=2,
-        num_cols=3
+        num_cols=2
     )
+    st_grid.add_graph(col=1, row=1, width=1, height=1,
+                      graph_id='st_amp_dist')
+    st_grid.add_graph(col=2, row=1, width=1, height=1,
+                      graph_id='st_amp_mag')
+    st_grid.add_graph(col=1, row=2, width=1, height=1,
+                      graph_id='st_pass_rate')
+    st_grid.add_graph(col=2, row=2, width=1, height=1,
+                      graph_id='st_site_term')
     return st_grid
@@ -0,0 +1,65 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip('openquake.hazardlib')
+pytest.importorskip('gmprocess')
+
+import utils  # NOQA
+from residuals import compute_residuals  # NOQA
+
+
+class LinearGsim(object):
+    # ln(PGA [g]) = -2 + 0.5 (M - 6) - ln(rrup + 10), sigma 0.6
+
+    def get_mean_and_stddevs(self, sites, rup, dists, imt, stddev_types):
+        mean = -2 + 0.5 * (rup.mag - 6) - np.log(dists.rrup + 10)
+        return mean, [np.full_like(mean, 0.6)]
+
+
+def get_metrics(nevents=8, nstations=12, seed=0):
+    rng = np.random.RandomState(seed)
+    event_terms = rng.normal(0, 0.4, nevents)
+    site_terms = rng.normal(0, 0.3, nstations)
+    rows = []
+    for event in range(nevents):
+        mag = rng.uniform(4, 7)
+        depth = rng.uniform(5, 20)
+        for station in range(nstations):
+            rjb = rng.uniform(5, 200)
+            rrup = np.sqrt(rjb**2 + depth**2)
+            mean = -2 + 0.5 * (mag - 6) - np.log(rrup + 10)
+            pga = 100 * np.exp(mean + event_terms[event] +
+                               site_terms[station] + rng.normal(0, 0.1))
+            rows.append({
+                'EarthquakeId': 'ev%d' % event,
+                'StationID': 'NN.S%02d' % station,
+                'EarthquakeMagnitude': mag,
+                'EarthquakeDepth': depth,
+                'EpicentralDistance': rjb,
+                'HypocentralDistance': rrup,
+                'RuptureDistance': rrup,
+                'JoynerBooreDistance': rjb,
+                'PGA': pga})
+    return pd.DataFrame(rows), event_terms, site_terms
+
+
+def test_compute_residuals(monkeypatch):
+    monkeypatch.setattr(utils, 'get_gsim', lambda mod: LinearGsim())
+    df, event_terms, site_terms = get_metrics()
+
+    resid = compute_residuals(df, 'PGA', 'LinearGsim')
+
+    assert resid.shape[0] == df.shape[0]
+    for col in ['Total residual', 'Bias', 'Between-event residual',
+                'Within-event residual', 'Site term',
+                'Single-station within-event residual']:
+        assert np.isfinite(resid[col]).all()
+    np.testing.assert_allclose(
+        resid['Total residual'],
+        resid['Bias'] + resid['Between-event residual'] +
+        resid['Site term'] + resid['Single-station within-event residual'])
+
+    # The recovered site terms follow the simulated ones up to the bias
+    stations = resid.groupby('StationID')['Site term'].first().values
+    assert np.corrcoef(stations, site_terms)[0, 1] > 0.9
@@ -1,4 +1,10 @@
 import os
+import time
+import multiprocessing
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor, as_completed, wait
+from concurrent.futures.process import BrokenProcessPool
+
 import numpy as np
 import pandas as pd
 
@@ -6,18 +12,45 @@ from openquake.hazardlib.imt import PGA, PGV, SA, RSD595, IA
 from openquake.hazardlib.const import IMC, StdDev
 from openquake.hazardlib.gsim.base import (
     SitesContext, RuptureContext, DistancesContext)
-from constants import IMC_MAPPINGS, MODELS_DICT
-
-from gmprocess.io.asdf.stream_workspace import StreamWorkspace
+from constants import (IMC_MAPPINGS, PROJECT_CACHE_SIZE, DIST_DICT, AZIMUTH,
+                       EVALUATION_CACHE_SIZE, EVALUATION_WORKERS,
+                       JOB_EVALUATION_WORKERS,
+                       EVALUATION_TIMEOUT, EVALUATION_RETRY, REC_CACHE_SIZE,
+                       PARTITION_CACHE_SIZE)
+from cache import (LRUCache, get_file_signature, get_project_cache_dir,
+                   read_table, get_cached_frame, get_event_partition,
+                   get_frame_hash, get_params_hash, get_shared, set_shared,
+                   memoize, get_optional_signature, MISSING)
+from workspaces import open_workspace, count_stream_bytes
+from metrics import count_cache
+from jobs import get_mp_context
+from gsims import (get_constant_name, get_model_capabilities,
+                   get_model_index, get_gsim)
+
+from gmprocess.waveform_processing import spectrum
+
+DIST_COLUMNS = list(DIST_DICT.keys())
+EVALUATION_COLUMNS = ['EarthquakeId', 'EarthquakeMagnitude',
+                      'EarthquakeDepth'] + DIST_COLUMNS
+EVALUATION_POOL = None
+TIMED_OUT = object()
+EVALUATION_CACHE = LRUCache(EVALUATION_CACHE_SIZE)
+EVALUATION_TIMEOUTS = LRUCache(EVALUATION_CACHE_SIZE)
 
 
 def load_dfs(wdir, proj, label):
+    # The derived frames are memoized on the signatures of the underlying
+    # files, so a rewrite by gmprocess invalidates them automatically.
+    return _load_dfs(wdir, proj, label, get_project_version(wdir, proj, label))
 
-    df_status = pd.read_csv(os.path.join(
-        wdir, '%s_%s_complete_failures.csv' % (proj, label)))
-    df_events = pd.read_csv(os.path.join(
-        wdir, '%s_%s_events.csv' % (proj, label)))
-    df_imc = pd.read_csv(os.path.join(wdir, get_imc_files(wdir)[0]))
+
+@memoize(PROJECT_CACHE_SIZE)
+def _load_dfs(wdir, proj, label, version):
+    cache_dir = get_project_cache_dir(wdir)
+    status_file, events_file, imc_file = get_project_files(wdir, proj, label)
+    df_status = read_table(status_file, cache_dir)
+    df_events = read_table(events_file, cache_dir)
+    df_imc = read_table(imc_file, cache_dir)
 
     df_status[['Network', 'Station', 'Channel']] = df_status[
         'StationID'].str.split('.', expand=True)
@@ -35,8 +68,26 @@ def load_dfs(wdir, proj, label):
     return (df_status, df_imc, df_eq, df_st, df_net, df_events)
 
 
+def get_project_files(wdir, proj, label):
+    return [os.path.join(wdir, '%s_%s_complete_failures.csv' % (proj, label)),
+            os.path.join(wdir, '%s_%s_events.csv' % (proj, label)),
+            os.path.join(wdir, get_imc_files(wdir)[0])]
+
+
+def get_project_version(wdir, proj, label):
+    return tuple(get_file_signature(file)
+                 for file in get_project_files(wdir, proj, label))
+
+
 def get_imc_files(wdir):
-    files = os.listdir(wdir)
+    # The directory listing only changes when files are added, removed or
+    # renamed, which updates the directory's modification time.
+    return _get_imc_files(wdir, os.stat(wdir).st_mtime_ns)
+
+
+@lru_cache(maxsize=PROJECT_CACHE_SIZE)
+def _get_imc_files(wdir, mtime):
+    files = sorted(os.listdir(wdir))
     return [file for file in files if
             file.split('.csv')[0].split('_')[-1] in IMC_MAPPINGS.keys()]
 
@@ -58,14 +109,16 @@ def compute_pass_fail_percentages(df, total_col):
 
 def get_eq_imc_df(wdir, proj, label, eqid, imc):
     if imc:
-        df = pd.read_csv(os.path.join(
-            wdir, '%s_%s_metrics_%s.csv' % (proj, label, imc)))
-        df = df[df['EarthquakeId'] == eqid]
-        df = df.merge(
-            pd.read_csv(os.path.join(
-                wdir, eqid, '%s_%s_failure_reasons_long.csv' % (proj, label))),
-            left_on='StationID', right_on='StationID')
-        return df
+        return get_event_partition(wdir, proj, label, eqid, imc)
+
+
+def get_event_version(wdir, proj, label, eqid, imc):
+    # Signatures of every file the event figures are built from
+    return tuple(get_optional_signature(path) for path in [
+        os.path.join(wdir, '%s_%s_metrics_%s.csv' % (proj, label, imc)),
+        os.path.join(wdir, eqid, '%s_%s_failure_reasons_long.csv' % (
+            proj, label)),
+        os.path.join(wdir, eqid, 'workspace.h5')])
 
 
 def get_options(df, regex):
@@ -76,17 +129,28 @@ def get_options(df, regex):
         return []
 
 
-def get_model_options(models_dict, imc, imt):
-    validated = []
-    for mod_name, mod_obj in models_dict.items():
-        if (manage_imts(imt)[0].__class__ in
-            mod_obj.DEFINED_FOR_INTENSITY_MEASURE_TYPES and
-            manage_imcs(imc) ==
-                mod_obj.DEFINED_FOR_INTENSITY_MEASURE_COMPONENT):
-            validated.append(mod_name)
+def get_current_value(options, value, default):
+    if value in [option['value'] for option in options]:
+        return value
+    return default
+
+
+def get_model_options(imc, imt):
+    # IMTs that no GSIM predicts (e.g. Pass/Fail) have no models
+    try:
+        imt_name = get_imt_name(imt)
+    except ValueError:
+        return []
+    validated = get_model_index().get(
+        (imt_name, get_constant_name(manage_imcs(imc))), [])
     return [{'label': mod_str, 'value': mod_str} for mod_str in validated]
 
 
+@lru_cache(maxsize=None)
+def get_imt_name(imt_str):
+    return manage_imts(imt_str)[0].__class__.__name__
+
+
 def manage_imts(imt_str):
     if imt_str is None:
         return None, None
@@ -127,22 +191,119 @@ def manage_imcs(imc_str):
         return None
 
 
-def is_model_valid_for_imt(mod_name, imt, models_dict):
-    mod_obj = models_dict[mod_name]
-    if (manage_imts(imt)[0].__class__ in
-            mod_obj.DEFINED_FOR_INTENSITY_MEASURE_TYPES):
+def is_model_valid_for_imt(mod_name, imt):
+    capability = get_model_capabilities()[mod_name]
+    if get_imt_name(imt) in capability['imts']:
         return True
     else:
         return False
 
 
+def get_rec_data(eqid, stid, wdir):
+    path = os.path.join(wdir, eqid, 'workspace.h5')
+    return _get_rec_data(eqid, stid, path, get_file_signature(path))
+
+
+@memoize(REC_CACHE_SIZE)
+def _get_rec_data(eqid, stid, path, signature):
+    with open_workspace(path) as handle:
+        labels = handle.processed_labels
+        r_st = handle.get_stream(eqid, stid, 'unprocessed')
+        if labels:
+            p_st = handle.get_stream(eqid, stid, labels[0])
+            v_st = p_st.copy().integrate()
+
+    rec_data = []
+    for tr_idx, r_tr in enumerate(r_st):
+        p_tr, v_tr = p_st[tr_idx], v_st[tr_idx]
+        sig_dict = p_tr.getCached('signal_spectrum')
+        noi_dict = p_tr.getCached('noise_spectrum')
+        sig_dict_s = p_tr.getCached('smooth_signal_spectrum')
+        noi_dict_s = p_tr.getCached('smooth_noise_spectrum')
+        snr_dict = p_tr.getCached('snr')
+        snr_conf = p_tr.getParameter('snr_conf')
+        fit_spectra_dict = p_tr.getParameter('fit_spectra')
+        model_spec = spectrum.model(
+            (fit_spectra_dict['moment'], fit_spectra_dict['stress_drop']),
+            freq=np.array(sig_dict_s['freq']),
+            dist=fit_spectra_dict['epi_dist'],
+            kappa=fit_spectra_dict['kappa'])
+        rec_data.append({
+            'raw_times': r_tr.times(),
+            'raw_data': r_tr.data,
+            'raw_min': r_tr.data.min(),
+            'raw_max': r_tr.data.max(),
+            'proc_times': p_tr.times(),
+            'proc_data': p_tr.data,
+            'vel_times': v_tr.times(),
+            'vel_data': v_tr.data,
+            'x_start': p_tr.stats.starttime - r_tr.stats.starttime,
+            'x_end': p_tr.stats.endtime - r_tr.stats.starttime,
+            'sig_spec': np.asarray(sig_dict['spec']),
+            'sig_freq': np.asarray(sig_dict['freq']),
+            'noi_spec': np.asarray(noi_dict['spec']),
+            'noi_freq': np.asarray(noi_dict['freq']),
+            'sig_spec_s': np.asarray(sig_dict_s['spec']),
+            'sig_freq_s': np.asarray(sig_dict_s['freq']),
+            'noi_spec_s': np.asarray(noi_dict_s['spec']),
+            'noi_freq_s': np.asarray(noi_dict_s['freq']),
+            'snr': np.asarray(snr_dict['snr']),
+            'snr_freq': np.asarray(snr_dict['freq']),
+            'model_spec': model_spec,
+            'threshold': snr_conf['threshold'],
+            'min_freq': snr_conf['min_freq'],
+            'max_freq': snr_conf['max_freq'],
+            'lp': p_tr.getProvenance('lowpass_filter')[0]['corner_frequency'],
+            'hp': p_tr.getProvenance(
+                'highpass_filter')[0]['corner_frequency'],
+            'f0': fit_spectra_dict['f0']})
+    return rec_data
+
+
+def decimate_minmax(x, y, max_points):
+    # Shape-preserving decimation: the samples are split into
+    # max_points / 2 buckets and the minimum and maximum of each bucket are
+    # kept in their original order, so peaks survive at any zoom level.
+    npts = len(y)
+    nbuckets = max_points // 2
+    if npts <= max_points or nbuckets < 1:
+        return x, y
+    # The last bucket is padded with the last sample, whose first
+    # occurrence wins the argmin/argmax ties, so no sample is left out
+    size = -(-npts // nbuckets)
+    nbuckets = -(-npts // size)
+    blocks = np.pad(np.asarray(y), (0, nbuckets * size - npts),
+                    mode='edge').reshape(nbuckets, size)
+    offsets = np.arange(nbuckets) * size
+    idx = np.unique(np.concatenate([
+        blocks.argmin(axis=1) + offsets,
+        blocks.argmax(axis=1) + offsets,
+        [0, npts - 1]]))
+    return x[idx], y[idx]
+
+
 def get_eq_full_status_df(wdir, eqid, imc):
-    ws = StreamWorkspace.open(os.path.join(wdir, eqid, 'workspace.h5'))
-    labels = ws.getLabels()
-    labels.remove('unprocessed')
-    processed_label = labels[0]
-    sc = ws.getStreams(ws.getEventIds()[0], labels=[processed_label])
-    ws.close()
+    # The pass/fail summary of an event is extracted from its workspace
+    # once and stored as a small table keyed by the workspace signature.
+    path = os.path.join(wdir, eqid, 'workspace.h5')
+    return _get_eq_full_status_df(wdir, eqid, get_file_signature(path))
+
+
+@lru_cache(maxsize=PARTITION_CACHE_SIZE)
+def _get_eq_full_status_df(wdir, eqid, signature):
+    status_dir = os.path.join(get_project_cache_dir(wdir), 'status')
+    os.makedirs(status_dir, exist_ok=True)
+    return get_cached_frame(
+        status_dir, eqid, signature,
+        lambda: extract_status_summary(
+            os.path.join(wdir, eqid, 'workspace.h5')))
+
+
+def extract_status_summary(path):
+    with open_workspace(path) as handle:
+        sc = handle.workspace.getStreams(
+            handle.event_ids[0], labels=[handle.processed_labels[0]])
+        count_stream_bytes(sc)
 
     rows = []
     for st in sc:
@@ -161,51 +322,201 @@ def get_eq_full_status_df(wdir, eqid, imc):
     return df
 
 
-def evaluate_model(site_params, rup_params, df, npts, azimuth, moveout,
-                   mod, imt):
+def get_workspace_event_ids(wdir):
+    return sorted(eqid for eqid in os.listdir(wdir) if os.path.exists(
+        os.path.join(wdir, eqid, 'workspace.h5')))
+
+
+def build_status_summaries(wdir, eqids=None, max_workers=None):
+    # Builds the pass/fail summaries of many events in parallel, returning
+    # the ids of the events that failed.
+    if eqids is None:
+        eqids = get_workspace_event_ids(wdir)
+    failed = []
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        futures = {pool.submit(get_eq_full_status_df, wdir, eqid, None): eqid
+                   for eqid in eqids}
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception:
+                failed.append(futures[future])
+    return failed
+
+
+def evaluate_model(site_params, rup_params, df, npts, azimuth, mod, imt):
+    return evaluate_models(
+        site_params, rup_params, df, npts, azimuth, [mod], imt)[mod]
+
+
+def evaluate_models(site_params, rup_params, df, npts, azimuth, mods, imt):
+    # Results are memoized on the model, IMT, event, hashed site/rupture
+    # parameters and the record distances, so re-renders with unchanged
+    # parameters do not evaluate the GSIMs again.
+    base_key = (imt, df['EarthquakeId'].iloc[0],
+                get_params_hash(site_params, rup_params), npts, azimuth,
+                get_frame_hash(df[DIST_COLUMNS]))
+    results = {}
+    for mod in mods:
+        results[mod] = EVALUATION_CACHE.get((mod,) + base_key, MISSING)
+        if results[mod] is not MISSING:
+            count_cache('evaluation', 'hit')
+            continue
+        timed_out = EVALUATION_TIMEOUTS.get((mod,) + base_key)
+        if timed_out is not None and (
+                time.time() - timed_out < EVALUATION_RETRY):
+            count_cache('evaluation', 'timeout')
+            results[mod] = None
+            continue
+        results[mod] = get_shared(('evaluation', mod) + base_key, MISSING)
+        if results[mod] is MISSING:
+            count_cache('evaluation', 'miss')
+        else:
+            count_cache('evaluation', 'shared_hit')
+            EVALUATION_CACHE.set((mod,) + base_key, results[mod])
+    pending = [mod for mod in mods if results[mod] is MISSING]
+
+    # Inside a background job worker even a single model goes through the
+    # pool, so that a hanging GSIM times out instead of blocking the job
+    if len(pending) == 1 and not is_job_worker():
+        results[pending[0]] = _evaluate_model(
+            site_params, rup_params, df, npts, azimuth, pending[0], imt)
+    elif pending:
+        results.update(evaluate_models_in_pool(
+            site_params, rup_params, df[EVALUATION_COLUMNS], npts, azimuth,
+            pending, imt))
+
+    for mod in pending:
+        if results[mod] is TIMED_OUT:
+            # Timed out models are remembered for a while rather than cached
+            # for good, so they can be retried later
+            EVALUATION_TIMEOUTS.set((mod,) + base_key, time.time())
+            results[mod] = None
+        elif results[mod] is MISSING:
+            results[mod] = None
+        else:
+            EVALUATION_CACHE.set((mod,) + base_key, results[mod])
+            set_shared(('evaluation', mod) + base_key, results[mod])
+    return results
+
+
+def is_job_worker():
+    return multiprocessing.parent_process() is not None
+
+
+def get_evaluation_pool():
+    # Every job worker has a pool of its own, kept small so that the
+    # number of processes stays bounded by JOB_WORKERS times
+    # JOB_EVALUATION_WORKERS
+    global EVALUATION_POOL
+    if EVALUATION_POOL is None:
+        EVALUATION_POOL = ProcessPoolExecutor(
+            max_workers=(JOB_EVALUATION_WORKERS if is_job_worker() else
+                         EVALUATION_WORKERS),
+            mp_context=get_mp_context())
+    return EVALUATION_POOL
+
+
+def evaluate_models_in_pool(site_params, rup_params, df, npts, azimuth,
+                            mods, imt):
+    # Each model gets EVALUATION_TIMEOUT seconds from submission. Models
+    # that are still running after that are reported as TIMED_OUT, models
+    # lost with a broken pool as MISSING; models that raise are reported as
+    # None by _evaluate_model itself.
+    global EVALUATION_POOL
+    pool = get_evaluation_pool()
+    futures = {pool.submit(_evaluate_model, site_params, rup_params, df,
+                           npts, azimuth, mod, imt): mod for mod in mods}
+    done, not_done = wait(futures, timeout=EVALUATION_TIMEOUT)
+    results = {}
+    for future in done:
+        try:
+            results[futures[future]] = future.result()
+        except BrokenProcessPool:
+            EVALUATION_POOL = None
+            results[futures[future]] = MISSING
+        except Exception:
+            results[futures[future]] = None
+    for future in not_done:
+        results[futures[future]] = TIMED_OUT
+    if not_done:
+        # Running evaluations cannot be cancelled, and would keep their
+        # workers busy, so the pool is killed and started again on the next
+        # call
+        EVALUATION_POOL = None
+        kill_pool(pool)
+    return results
+
+
+def kill_pool(pool):
+    processes = list((pool._processes or {}).values())
+    pool.shutdown(wait=False, cancel_futures=True)
+    for process in processes:
+        process.terminate()
+
+
+def evaluate_records(site_params, rup_params, df, mod, imt):
+    # Model mean and total standard deviation at every record of a single
+    # event, without the moveout grid. Site parameters may be arrays with
+    # one value per record.
+    result = _evaluate_model(
+        site_params, rup_params, df, 0, AZIMUTH, mod, imt)
+    if result is not None:
+        return result[2], result[3]
+
+
+def get_residual_stats(obs, mean, sd):
+    # Normalized residual mean and standard deviation, and the average
+    # sample log-likelihood (LLH) of Scherbaum et al. (2009).
+    resid = (np.log(obs) - np.log(mean)) / sd
+    pdf = np.exp(-0.5 * resid**2) / (sd * np.sqrt(2 * np.pi))
+    return {'mean': np.mean(resid),
+            'std': np.std(resid),
+            'llh': -np.mean(np.log2(pdf))}
+
+
+def _evaluate_model(site_params, rup_params, df, npts, azimuth, mod, imt):
+    # The moveout grid and the records are evaluated in a single call by
+    # stacking the npts grid points in front of the records.
+    nrec = df.shape[0]
+    ntot = npts + nrec
     sx = SitesContext()
     rx = RuptureContext()
     dx = DistancesContext()
 
     # TODO: some site parameters can be pulled from the dataframe so we don't
     # have to use the defaults (vs30, azimuth, etc.)
-    if not moveout:
-        npts = df.shape[0]
     for param in site_params.keys():
-        setattr(sx, param, np.full(npts, site_params[param]))
+        setattr(sx, param, np.full(ntot, site_params[param]))
 
+    depth = df['EarthquakeDepth'].iloc[0]
     rx.__dict__.update(rup_params)
     rx.mag = df['EarthquakeMagnitude'].iloc[0]
-    rx.hypo_depth = df['EarthquakeDepth'].iloc[0]
+    rx.hypo_depth = depth
 
-    if moveout:
-        dx.rjb = np.linspace(0, df['JoynerBooreDistance'].max(), npts)
-        dx.rrup = np.sqrt(dx.rjb**2 + df['EarthquakeDepth'].iloc[0]**2)
-        dx.rhypo = dx.rrup
-        dx.repi = dx.rjb
-    else:
-        dx.rjb = df['JoynerBooreDistance']
-        dx.rrup = df['RuptureDistance']
-        dx.rhypo = df['HypocentralDistance']
-        dx.repi = df['EpicentralDistance']
+    rjb = np.linspace(0, df['JoynerBooreDistance'].max(), npts)
+    rrup = np.sqrt(rjb**2 + depth**2)
+    moveout = {'rjb': rjb, 'rrup': rrup, 'rhypo': rrup, 'repi': rjb}
+    for dist, col in [('rjb', 'JoynerBooreDistance'),
+                      ('rrup', 'RuptureDistance'),
+                      ('rhypo', 'HypocentralDistance'),
+                      ('repi', 'EpicentralDistance')]:
+        setattr(dx, dist, np.concatenate([moveout[dist], df[col].values]))
 
     # TODO: some of these distances can be pulled from the dataframe
     dx.ry0 = dx.rjb
     dx.rx = np.full_like(dx.rjb, -1)
-    dx.azimuth = np.full_like(npts, azimuth)
+    dx.azimuth = np.full(ntot, azimuth)
     dx.rcdpp = dx.rjb
     dx.rvolc = dx.rjb
 
     try:
-        mean, sd = MODELS_DICT[mod]().get_mean_and_stddevs(
+        mean, sd = get_gsim(mod).get_mean_and_stddevs(
             sx, rx, dx, manage_imts(imt)[0], [StdDev.TOTAL])
         mean = convert_units(mean, imt)
-        if moveout:
-            return mean, dx
-        else:
-            return mean, sd[0]
     except Exception:
         return
+    return moveout, mean[:npts], mean[npts:], sd[0][npts:]
 
 
 def convert_units(data, imt):
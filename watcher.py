@@ -0,0 +1,126 @@
+import os
+import hashlib
+import threading
+
+from constants import WATCH_INTERVAL
+from cache import (get_file_signature, get_file_tail_hash,
+                   get_project_cache_dir, append_table)
+from utils import get_imc_files
+
+WATCHERS_LOCK = threading.Lock()
+WATCHERS = {}
+WATCH_ENABLED = [False]
+
+
+class ProjectWatcher(object):
+    # Polls the summary tables and event directories of a project. Tables
+    # that gmprocess only appended to are merged into their cached frames
+    # right away, so that the next load parses the new rows only, and the
+    # per-event metrics partitions only rewrite the events in the new rows.
+    # The derived frames (events, stations, networks) are still regrouped
+    # from the whole tables, which is cheap next to parsing them. When the
+    # optional watchdog package is installed, filesystem events wake the
+    # poller up early.
+
+    def __init__(self, wdir, proj, label, interval=WATCH_INTERVAL):
+        self.wdir = wdir
+        self.proj = proj
+        self.label = label
+        self.interval = interval
+        self.files = {}
+        self.version = None
+        self.wake = threading.Event()
+        self.stopped = False
+        self.observer = None
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.scan()
+        self.thread.start()
+        try:
+            from watchdog.observers import Observer
+            from watchdog.events import FileSystemEventHandler
+        except ImportError:
+            return
+        handler = FileSystemEventHandler()
+        handler.on_any_event = lambda event: self.wake.set()
+        self.observer = Observer()
+        self.observer.schedule(handler, self.wdir, recursive=True)
+        self.observer.daemon = True
+        self.observer.start()
+
+    def stop(self):
+        self.stopped = True
+        self.wake.set()
+        if self.observer is not None:
+            self.observer.stop()
+
+    def run(self):
+        while not self.stopped:
+            self.wake.wait(self.interval)
+            self.wake.clear()
+            try:
+                self.scan()
+            except OSError:
+                pass
+
+    def get_tables(self):
+        prefix = '%s_%s_' % (self.proj, self.label)
+        return [os.path.join(self.wdir, file) for file in
+                [prefix + 'complete_failures.csv', prefix + 'events.csv'] +
+                get_imc_files(self.wdir)]
+
+    def get_event_files(self):
+        files = []
+        for eqid in sorted(os.listdir(self.wdir)):
+            event_dir = os.path.join(self.wdir, eqid)
+            if os.path.isdir(event_dir):
+                files += [os.path.join(event_dir, 'workspace.h5'),
+                          os.path.join(event_dir, '%s_%s_%s' % (
+                              self.proj, self.label,
+                              'failure_reasons_long.csv'))]
+        return files
+
+    def scan(self):
+        cache_dir = get_project_cache_dir(self.wdir)
+        tables = self.get_tables()
+        files = {}
+        for path in tables + self.get_event_files():
+            if not os.path.exists(path):
+                continue
+            signature = get_file_signature(path)
+            previous = self.files.get(path)
+            if path in tables:
+                if previous is not None and previous[0] != signature:
+                    append_table(path, cache_dir, *previous)
+                files[path] = (signature, get_file_tail_hash(
+                    path, signature[1]))
+            else:
+                files[path] = (signature, None)
+
+        # The version only depends on the files, so every worker process
+        # of a multi-process server reports the same one
+        self.files = files
+        self.version = hashlib.sha1(repr(sorted(
+            (path, signature) for path, (signature, _) in files.items())
+        ).encode('utf-8')).hexdigest()
+
+
+def configure_watcher(enabled=True):
+    WATCH_ENABLED[0] = str(enabled).lower() in ['true', '1', 'yes']
+
+
+def get_watcher(wdir, proj, label):
+    with WATCHERS_LOCK:
+        watcher = WATCHERS.get((wdir, proj, label))
+        if watcher is None:
+            watcher = WATCHERS[(wdir, proj, label)] = ProjectWatcher(
+                wdir, proj, label)
+            watcher.start()
+    return watcher
+
+
+def get_data_version(wdir, proj, label):
+    if not WATCH_ENABLED[0] or not os.path.isdir(wdir):
+        return None
+    return get_watcher(wdir, proj, label).version
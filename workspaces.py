@@ -0,0 +1,102 @@
+import atexit
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from gmprocess.io.asdf.stream_workspace import StreamWorkspace
+
+from constants import MAX_OPEN_WORKSPACES
+from cache import get_file_signature
+from metrics import count_bytes_read
+
+POOL_LOCK = threading.Lock()
+POOL = OrderedDict()
+
+
+class WorkspaceHandle(object):
+    # An open workspace together with the metadata that every request
+    # needs, so that it is only read once per open.
+
+    def __init__(self, path):
+        self.path = path
+        self.signature = get_file_signature(path)
+        self.workspace = StreamWorkspace.open(path)
+        self.labels = self.workspace.getLabels()
+        self.event_ids = self.workspace.getEventIds()
+        self.lock = threading.Lock()
+        self.users = 0
+        self.closed = False
+
+    @property
+    def processed_labels(self):
+        return [label for label in self.labels if label != 'unprocessed']
+
+    def get_stream(self, eqid, stid, label):
+        # Only the requested station and label are read. The network code
+        # is used to pick the right stream when station codes are shared.
+        network, station = stid.split('.')[:2]
+        streams = self.workspace.getStreams(
+            eqid, stations=[station], labels=[label])
+        count_stream_bytes(streams)
+        for st in streams:
+            if st[0].stats.network == network:
+                return st
+        return streams[0]
+
+    def close(self):
+        if not self.closed:
+            self.workspace.close()
+            self.closed = True
+
+
+def count_stream_bytes(streams):
+    # The decoded size of the waveforms stands in for the bytes read from
+    # the HDF5 file, which pyasdf does not expose.
+    count_bytes_read('hdf5', sum(tr.data.nbytes for st in streams
+                                 for tr in st))
+
+
+@contextmanager
+def open_workspace(path):
+    # Handles are pooled by path with at most MAX_OPEN_WORKSPACES open at a
+    # time. The least recently used idle handle is closed when the pool is
+    # full, and a handle is reopened if gmprocess rewrote the file. Access
+    # to a handle is serialized because pyasdf is not thread-safe.
+    with POOL_LOCK:
+        handle = POOL.get(path)
+        if handle is not None and handle.users == 0 and (
+                handle.signature != get_file_signature(path)):
+            handle.close()
+            handle = None
+        if handle is None:
+            handle = WorkspaceHandle(path)
+            POOL[path] = handle
+        POOL.move_to_end(path)
+        handle.users += 1
+        evict_workspaces()
+
+    try:
+        with handle.lock:
+            yield handle
+    finally:
+        with POOL_LOCK:
+            handle.users -= 1
+            if POOL.get(path) is not handle and handle.users == 0:
+                handle.close()
+
+
+def evict_workspaces():
+    for path in list(POOL):
+        if len(POOL) <= MAX_OPEN_WORKSPACES:
+            break
+        if POOL[path].users == 0:
+            POOL.pop(path).close()
+
+
+@atexit.register
+def close_workspaces():
+    # HDF5 files left open at exit are flushed by the interpreter in an
+    # arbitrary order, so they are closed explicitly
+    with POOL_LOCK:
+        while POOL:
+            POOL.popitem()[1].close()
@@ -0,0 +1,10 @@
+# WSGI entry point for production servers, configured through a JSON file
+# named by GMPROCESS_VISUALIZE_CONFIG or GMPROCESS_VISUALIZE_* variables,
+# e.g.
+#
+#   GMPROCESS_VISUALIZE_WDIR=/data/proj GMPROCESS_VISUALIZE_PROJ=proj \
+#   GMPROCESS_VISUALIZE_LABEL=default gunicorn -w 4 wsgi:server
+from index import create_app
+
+app = create_app()
+server = app.server